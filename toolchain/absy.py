@@ -5,25 +5,44 @@ Abstract syntax tree classes
 
 import ir
 
+def walk(node):
+    """
+    Iterate over node and all of its subexpressions without recursion
+    """
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(node.children())
+
 class Node(object):
+    __slots__ = ()
+
+    def children(self):
+        """
+        Nodes directly below this one in the syntax tree
+        """
+        return ()
+
     def free_variables(self):
         """
         By default AST node has no free variabls associated with it
         """
         return set()
         
-    def check(self, gctx, lctx=None):
-        return ()
-
 class Value(Node):
+    __slots__ = ()
+
     def evaluate(self, *args):
         return self.value
     
 class Expr(Node):
-    pass
+    __slots__ = ()
 
 
 class Definition(Node):
+    __slots__ = "name", "args", "return_type", "body", "token"
+
     def __init__(self, name, args, return_type, body, token):
         self.name = name
         self.args = args
@@ -31,28 +50,9 @@ class Definition(Node):
         self.body = body
         self.token = token
         
-    def check(self, gctx):
-        arg_names = []
-        for arg_name, arg_type in self.args:
-            if arg_name in arg_names:
-                yield self.token, "Multiple arguments with same name: %s" % arg_name
-            else:
-                arg_names.append(arg_name)
-        lctx = dict(self.args)
-        for e, err in self.body.check(gctx, lctx):
-            yield e, err
-        
-    def check_application(self, expr_types):
-        """
-        Check function application with particular parameter types
-        """
-        if len(expr_types) != len(self.args):
-            yield self.token, "Was expecting %s arguments, got %d" % (len(self.args), len(expr_types))
-        else:
-            for index, (arg_nam, arg_type) in enumerate(self.args):
-                if expr_types[index] != arg_type:
-                    yield self.token, "Was expecting %s, got %s" % (arg_type, expr_types[index])
-        
+    def children(self):
+        return (self.body,)
+
     def evaluate(self, parameters, gctx={}):
         """
         Evaluate function body with given parameters and functions defined in global context
@@ -69,31 +69,29 @@ class DefinitionBuiltin(Definition):
     
     def __init__(self):
         pass
+
+    def children(self):
+        return ()
         
         
 class Apply(Node):
+    __slots__ = "func_name", "parameters", "token", "type"
+
     def __init__(self, func_name, parameters, token):
         self.func_name = func_name
         self.parameters = parameters
         self.token = token
+        self.type = None
         
+    def children(self):
+        return self.parameters
+
     def free_variables(self):
         r = set()
         for param in self.parameters:
             r.update(param.free_variables())
         return s
         
-    def check(self, gctx, lctx):
-        """
-        Attempt to check function call with lctx types and gctx function (signatures)
-        """
-        if self.func_name not in gctx:
-            yield self.token, "Could not resolve function named %s" % self.func_name
-        return
-        
-    def infer_type(self):
-        return gctx[self.func_name].return_type
-        
     def evaluate(self, lctx={}, gctx={}):
         """
         Attempt to evaluate function call with lctx values and gctx functions
@@ -104,27 +102,26 @@ class Apply(Node):
         return self.func_name + "(" + ", ".join([repr(j) for j in self.parameters]) + ")"
     
 class Variable(Node):
+    __slots__ = "name", "token", "type"
+
     def __init__(self, name, token):
         self.name = name
         self.token = token
+        self.type = None
         
     def free_variables(self):
         return set(self.name)
         
-    def infer_type(self):
-        return lctx[self.name].infer_type()
-        
     def evaluate(self, lctx={}, gctx={}):
         return lctx[self.name]
         
     def __repr__(self):
         return self.name
         
-    def check(self, gctx, lctx):
-        if self.name not in lctx:
-            yield self.token, "Variable not defined in local context"
-
 class Boolean(Value):
+    __slots__ = "value",
+    type = "bool"
+
     def __init__(self, value):
         if value in ("True", "true", "1", 1, True):
             self.value = True
@@ -137,6 +134,9 @@ class Boolean(Value):
         return "True" if self.value else "False"
     
 class Nat(Value):
+    __slots__ = "value",
+    type = "nat"
+
     def __init__(self, value):
         value = int(value)
         if (value < 0):
@@ -150,11 +150,46 @@ class Nat(Value):
         return self.value
 
 
+class Let(Expr):
+    """
+    Binds value of expression to a name for evaluating the body,
+    produced by program transformations, there is no syntax for it
+    """
+    __slots__ = "name", "expr_value", "expr_body", "token", "type"
+
+    def __init__(self, name, expr_value, expr_body, token=None):
+        self.name = name
+        self.expr_value = expr_value
+        self.expr_body = expr_body
+        self.token = token
+        self.type = None
+
+    def children(self):
+        return self.expr_value, self.expr_body
+
+    def __repr__(self):
+        return "LET " + self.name + " == " + repr(self.expr_value) + " IN " + repr(self.expr_body)
+
+    def evaluate(self, lctx={}, gctx={}):
+        lctx = dict(lctx)
+        lctx[self.name] = self.expr_value.evaluate(lctx, gctx)
+        return self.expr_body.evaluate(lctx, gctx)
+
+
 class Conditional(Expr):
-    def __init__(self, expr_if, expr_then, expr_else=None):
+    __slots__ = "expr_if", "expr_then", "expr_else", "token", "type"
+
+    def __init__(self, expr_if, expr_then, expr_else=None, token=None):
         self.expr_if = expr_if
         self.expr_then = expr_then
         self.expr_else = expr_else
+        self.token = token
+        self.type = None
+
+    def children(self):
+        if self.expr_else is None:
+            return self.expr_if, self.expr_then
+        return self.expr_if, self.expr_then, self.expr_else
 
     def free_variables(self):
         return self.expr_if.free_variables().union(self.expr_then.free_variables().union(self.expr_else.free_variables()))
@@ -167,13 +202,3 @@ class Conditional(Expr):
             return self.expr_then.evaluate(lctx, gctx)
         else:
             return self.expr_else.evaluate(lctx, gctx)
-
-    def check(self, gctx, lctx):
-        for d, err in self.expr_if.check(gctx, lctx):
-            yield d, err
-        for d, err in self.expr_then.check(gctx, lctx):
-            yield d, err
-        for d, err in self.expr_else.check(gctx, lctx):
-            yield d, err        
-
-        
@@ -0,0 +1,148 @@
+# coding: utf-8
+"""
+Precompiled syntax tree cache. Checked definitions are serialized with
+marshal next to the source file, keyed by hash of the source and of the
+toolchain itself. Loading rebuilds absy nodes without lexing, parsing
+or checking the source again.
+"""
+
+import os
+import sys
+import hashlib
+import marshal
+import absy
+import lexer
+import builtin
+import hashcons
+import parser
+import ctxcheck
+
+MAGIC = "MOPALAST"
+
+# Node tags of the serialized node table
+NAT, BOOLEAN, VARIABLE, APPLY, CONDITIONAL = range(5)
+
+def toolchain_version():
+    """
+    Digest of the modules that determine the shape of checked syntax tree,
+    editing any of them invalidates cached files
+    """
+    digest = hashlib.sha1()
+    for module in absy, lexer, builtin, parser, ctxcheck, sys.modules[__name__]:
+        with open(os.path.splitext(module.__file__)[0] + ".py", "rb") as fh:
+            digest.update(fh.read())
+    return digest.hexdigest()
+
+VERSION = toolchain_version()
+
+def source_digest(filename, chunk_size=65536):
+    digest = hashlib.sha1()
+    with open(filename, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), ""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def cache_filename(filename):
+    return filename[:-3] + ".moc"
+
+def dumps(defs, digest):
+    """
+    Serialize checked definitions, expression nodes are hash-consed and
+    stored in a table where children come before their parents,
+    inferred types are stored along with the nodes
+    """
+    interner = hashcons.Interner()
+    table = []
+    index = {}
+    definitions = []
+    for d in defs:
+        body = interner.intern(d.body, dict(d.args))
+        stack = [(body, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if id(node) in index:
+                continue
+            children = node.children()
+            if not expanded and children:
+                stack.append((node, True))
+                stack.extend([(child, False) for child in children])
+                continue
+            if isinstance(node, absy.Nat):
+                entry = NAT, node.value
+            elif isinstance(node, absy.Boolean):
+                entry = BOOLEAN, node.value
+            elif isinstance(node, absy.Variable):
+                entry = VARIABLE, intern(node.name), node.token.line, node.token.column, node.type
+            elif isinstance(node, absy.Apply):
+                entry = (APPLY, intern(node.func_name), node.token.line, node.token.column, node.type) + tuple([index[id(child)] for child in children])
+            elif isinstance(node, absy.Conditional):
+                entry = (CONDITIONAL, node.token.line, node.token.column, node.type) + tuple([index[id(child)] for child in children])
+            else:
+                raise Exception("Don't know how to serialize: %s of class %s" % (node, node.__class__.__name__))
+            index[id(node)] = len(table)
+            table.append(entry)
+        definitions.append((d.name, d.args, d.return_type, index[id(body)], d.token.line, d.token.column))
+    return marshal.dumps((MAGIC, VERSION, digest, tuple(table), tuple(definitions)))
+
+def loads(data, digest):
+    """
+    Rebuild global context from serialized definitions,
+    return None if data was written for another source or toolchain
+    """
+    try:
+        magic, version, cached_digest, table, definitions = marshal.loads(data)
+    except (EOFError, ValueError, TypeError):
+        return None
+    if (magic, version, cached_digest) != (MAGIC, VERSION, digest):
+        return None
+
+    nodes = []
+    append = nodes.append
+    for entry in table:
+        tag = entry[0]
+        if tag == NAT:
+            append(absy.Nat(entry[1]))
+        elif tag == BOOLEAN:
+            append(absy.Boolean(entry[1]))
+        elif tag == VARIABLE:
+            node = absy.Variable(entry[1], lexer.TokenIdentifier(entry[1], entry[2], entry[3]))
+            node.type = entry[4]
+            append(node)
+        elif tag == APPLY:
+            node = absy.Apply(entry[1], tuple([nodes[i] for i in entry[5:]]), lexer.TokenIdentifier(entry[1], entry[2], entry[3]))
+            node.type = entry[4]
+            append(node)
+        else:
+            node = absy.Conditional(*[nodes[i] for i in entry[4:]], token=lexer.TokenIf("IF", entry[1], entry[2]))
+            node.type = entry[3]
+            append(node)
+
+    gctx = ctxcheck.global_context()
+    for name, args, return_type, body, line, column in definitions:
+        gctx[name] = absy.Definition(name, args, return_type, nodes[body], lexer.TokenDef("DEF", line, column))
+    return gctx
+
+def front_end(filename):
+    """
+    Return global context and errors for the source file like context_check,
+    the cache file is used if it is up to date and rewritten otherwise
+    """
+    digest = source_digest(filename)
+    if os.path.exists(cache_filename(filename)):
+        with open(cache_filename(filename), "rb") as fh:
+            gctx = loads(fh.read(), digest)
+        if gctx is not None:
+            return gctx, ()
+
+    defs, state = parser.StreamParser(lexer.tokenize(filename)).parse()
+    gctx, errors = ctxcheck.context_check(defs)
+    if not errors:
+        with open(cache_filename(filename), "wb") as fh:
+            fh.write(dumps(defs, digest))
+    return gctx, errors
+
+if __name__ == "__main__":
+    for filename in sys.argv[1:]:
+        gctx, errors = front_end(filename)
+        for node, msg in errors:
+            print msg, "on line", node.line, "column", node.column
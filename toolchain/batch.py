@@ -0,0 +1,226 @@
+# coding: utf-8
+"""
+Batched evaluation, a function is evaluated over arrays of arguments at
+once with NumPy. Built-ins become array operations, both branches of a
+conditional are evaluated on the lanes that take them and self tail
+recursion runs as a loop over the lanes that have not finished yet:
+
+    evaluator = BatchEvaluator(gctx)
+    evaluator.evaluate("sqrt", numpy.arange(1, 1000000))
+
+Other recursive functions and results not fitting in 64 bits are
+evaluated lane by lane with the closure interpreter, as is everything
+if NumPy is not installed.
+"""
+
+import sys
+import absy
+import builtin
+import callgraph
+import closures
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class Unvectorizable(Exception):
+    """
+    Raised when batch can not be evaluated with array operations
+    """
+    pass
+
+def checked_add(a, b):
+    result = a + b
+    if (((a ^ result) & (b ^ result)) < 0).any():
+        raise Unvectorizable("Addition overflows 64 bits")
+    return result
+
+def checked_sub(a, b):
+    result = a - b
+    if (((a ^ b) & (a ^ result)) < 0).any():
+        raise Unvectorizable("Subtraction overflows 64 bits")
+    return result
+
+def checked_mul(a, b):
+    result = a * b
+    nonzero = a != 0
+    if (result[nonzero] // a[nonzero] != b[nonzero]).any() or ((a == -1) & (b == result)).any():
+        raise Unvectorizable("Multiplication overflows 64 bits")
+    return result
+
+def checked_div(a, b):
+    if (b == 0).any():
+        raise ZeroDivisionError("integer division or modulo by zero")
+    return a // b # Rounds down like division of Python integers
+
+BUILTIN_MAPPING = {
+    builtin.DefinitionEq:       lambda a, b: a == b,
+    builtin.DefinitionLessThan: lambda a, b: a < b,
+    builtin.DefinitionAdd:      checked_add,
+    builtin.DefinitionSub:      checked_sub,
+    builtin.DefinitionMul:      checked_mul,
+    builtin.DefinitionDiv:      checked_div
+}
+
+def dtype(type_name):
+    return numpy.bool_ if type_name == "bool" else numpy.int64
+
+def checked_array(values, type_name):
+    """
+    Array of values evaluated one by one, they may not fit in 64 bits
+    """
+    if type_name != "bool":
+        limits = numpy.iinfo(numpy.int64)
+        if any([not limits.min <= value <= limits.max for value in values]):
+            raise Unvectorizable("Result does not fit in 64 bits")
+    return numpy.array(values, dtype=dtype(type_name))
+
+class BatchEvaluator(object):
+    def __init__(self, gctx):
+        self.gctx = gctx
+        self.graph = callgraph.CallGraph(gctx)
+        self.functions = {} # Compiled closures for lanes evaluated one by one
+        self.fallbacks = 0 # Number of lanes evaluated one by one
+        # Functions whose only recursion is calling themselves in tail position
+        self.loops = set()
+        for name in self.graph.calls:
+            if self.graph.is_recursive(name) and len(self.graph.component[name]) == 1:
+                d = gctx[name]
+                tail_calls = len(list(self.tail_calls(d)))
+                if tail_calls == len([node for node in absy.walk(d.body) if isinstance(node, absy.Apply) and node.func_name == name]):
+                    self.loops.add(name)
+
+    def tail_calls(self, d):
+        stack = [d.body]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, absy.Conditional):
+                stack.extend(node.children()[1:])
+            elif isinstance(node, absy.Apply) and node.func_name == d.name:
+                yield node
+
+    def evaluate(self, name, *columns):
+        """
+        Evaluate function for every lane of argument columns, return array
+        of results or list of them if NumPy is not available
+        """
+        d = self.gctx[name]
+        if len(columns) != len(d.args):
+            raise ValueError("Function %s requires %d argument columns, got %d" % (name, len(d.args), len(columns)))
+        if numpy is None:
+            return self.scalar(name, columns)
+        columns = [numpy.asarray(column, dtype=dtype(arg_type)) for column, (arg_name, arg_type) in zip(columns, d.args)]
+        if len(set([len(column) for column in columns])) > 1:
+            raise ValueError("Argument columns of different length")
+        try:
+            with numpy.errstate(all="ignore"):
+                return self.call(name, columns)
+        except Unvectorizable:
+            return numpy.array(self.scalar(name, columns), dtype=object)
+
+    def scalar(self, name, columns):
+        """
+        Evaluate function lane by lane
+        """
+        if name not in self.functions:
+            self.functions[name] = closures.compile_program(self.gctx, root=name)[name]
+        function = self.functions[name]
+        results = [function(tuple([column.item() if hasattr(column, "item") else column for column in lane])) for lane in zip(*columns)]
+        self.fallbacks += len(results)
+        return results
+
+    def call(self, name, env):
+        d = self.gctx[name]
+        if name in self.loops:
+            return self.loop(d, env)
+        if self.graph.is_recursive(name):
+            return checked_array(self.scalar(name, env), d.return_type)
+        return self.expression(d.body, d, env)
+
+    def loop(self, d, env):
+        """
+        Evaluate self tail recursive function, lanes making another self
+        call are run again with the new arguments until all have finished
+        """
+        results = numpy.empty(len(env[0]) if env else 1, dtype=dtype(d.return_type))
+        lanes = numpy.arange(len(results))
+        while len(lanes):
+            finished, values, env = self.tail(d.body, d, env)
+            results[lanes[finished]] = values[finished]
+            lanes = lanes[~finished]
+            env = [column[~finished] for column in env]
+        return results
+
+    def tail(self, node, d, env):
+        """
+        Evaluate expression in tail position, return mask of lanes that
+        finished, their values and arguments of the lanes calling d again
+        """
+        size = len(env[0]) if env else 1
+        if isinstance(node, absy.Conditional) and node.expr_else is not None:
+            mask = self.expression(node.expr_if, d, env)
+            finished = numpy.empty(size, dtype=numpy.bool_)
+            values = numpy.empty(size, dtype=dtype(d.return_type))
+            arguments = [numpy.empty(size, dtype=column.dtype) for column in env]
+            for branch, lanes in (node.expr_then, mask), (node.expr_else, ~mask):
+                if lanes.any():
+                    branch_finished, branch_values, branch_arguments = self.tail(branch, d, [column[lanes] for column in env])
+                    finished[lanes] = branch_finished
+                    values[lanes] = branch_values
+                    for column, branch_column in zip(arguments, branch_arguments):
+                        column[lanes] = branch_column
+            return finished, values, arguments
+        if isinstance(node, absy.Apply) and node.func_name == d.name:
+            return numpy.zeros(size, dtype=numpy.bool_), numpy.empty(size, dtype=dtype(d.return_type)), [self.expression(p, d, env) for p in node.parameters]
+        return numpy.ones(size, dtype=numpy.bool_), self.expression(node, d, env), env
+
+    def expression(self, node, d, env):
+        """
+        Evaluate expression over the lanes of env, a list of argument columns
+        """
+        size = len(env[0]) if env else 1
+        slots = dict([(arg_name, index) for index, (arg_name, arg_type) in enumerate(d.args)])
+        evaluated = {}
+        stack = [(node, False)]
+        root = node
+        while stack:
+            node, expanded = stack.pop()
+            if id(node) in evaluated:
+                continue
+            if isinstance(node, absy.Conditional):
+                # Branches are evaluated on their own lanes only
+                if node.expr_else is None:
+                    raise Unvectorizable("Conditional without ELSE")
+                if node.type is None:
+                    raise Unvectorizable("Conditional was not annotated with type")
+                mask = self.expression(node.expr_if, d, env)
+                result = numpy.empty(size, dtype=dtype(node.type))
+                for branch, lanes in (node.expr_then, mask), (node.expr_else, ~mask):
+                    if lanes.any():
+                        result[lanes] = self.expression(branch, d, [column[lanes] for column in env])
+                evaluated[id(node)] = result
+                continue
+            children = node.children()
+            if not expanded and children:
+                stack.append((node, True))
+                stack.extend([(child, False) for child in children])
+                continue
+            children = [evaluated[id(child)] for child in children]
+
+            if isinstance(node, absy.Variable):
+                evaluated[id(node)] = env[slots[node.name]]
+            elif isinstance(node, absy.Value):
+                evaluated[id(node)] = numpy.full(size, node.value, dtype=dtype(node.type))
+            elif isinstance(node, absy.Apply):
+                f = self.gctx[node.func_name]
+                if isinstance(f, absy.DefinitionBuiltin):
+                    evaluated[id(node)] = BUILTIN_MAPPING[f.__class__](*children)
+                else:
+                    evaluated[id(node)] = self.call(node.func_name, children)
+            else:
+                raise Unvectorizable("Don't know how to evaluate: %s of class %s" % (node, node.__class__.__name__))
+        return evaluated[id(root)]
+
+def evaluate(gctx, name, *columns):
+    return BatchEvaluator(gctx).evaluate(name, *columns)
@@ -0,0 +1,411 @@
+# coding: utf-8
+"""
+Benchmarks for the toolchain, run all of them with:
+
+    python benchmark.py
+
+or pick some of them by name:
+
+    python benchmark.py lexer
+"""
+
+import os
+import sys
+import resource
+import tempfile
+from timeit import default_timer as clock
+import absy
+import astcache
+import batch
+import closures
+import coder
+import ctxcheck
+import cse
+import lazy
+import lexer
+import memo
+import hashcons
+import parparse
+import pareval
+import partial
+import peephole
+import pycoder
+import incremental
+import inliner
+import uebb
+from multiprocessing import cpu_count
+from parser import Parser, CursorParser, StreamParser
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples")
+
+def generate_lines(definitions):
+    """
+    Generate lines of µ-Opal source with given number of definitions,
+    every definition calls the previous one
+    """
+    yield "-- Generated program with %d definitions\n" % definitions
+    yield "DEF MAIN:nat == f%d(1, 2)\n" % (definitions - 1)
+    yield "DEF f0(x:nat, y:nat):nat == add(x, y)\n"
+    for i in xrange(1, definitions):
+        yield "DEF f%d(x:nat, y:nat):nat == IF lt(x, y) THEN add(f%d(x, y), mul(y, 2)) ELSE sub(x, div(y, 3)) FI -- %d\n" % (i, i - 1, i)
+
+def generate_program(definitions):
+    return "".join(generate_lines(definitions))
+
+def measure(func, *args):
+    """
+    Return the result of func(*args) and the time it took in seconds
+    """
+    started = clock()
+    result = func(*args)
+    return result, clock() - started
+
+def bench_lexer():
+    for definitions in 1000, 10000, 50000:
+        source = generate_program(definitions)
+        count, elapsed = measure(lambda: sum(1 for token in lexer.tokenize_source(source)))
+        print "%6d definitions, %8d tokens, %6.2f MB in %6.3fs: %6.2f MB/s" % (
+            definitions, count, len(source) / 1e6, elapsed, len(source) / 1e6 / elapsed)
+
+def peak_memory():
+    """
+    Return peak resident set size of the process in megabytes
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def bench_stream():
+    # Sizes are increasing, peak memory should stay where the smallest run left it
+    for definitions in 10000, 50000, 100000:
+        fd, filename = tempfile.mkstemp(suffix=".mo")
+        with os.fdopen(fd, "w") as fh:
+            fh.writelines(generate_lines(definitions))
+        try:
+            size = os.path.getsize(filename)
+            count, elapsed = measure(lambda: sum(1 for d in StreamParser(lexer.tokenize(filename)).definitions()))
+        finally:
+            os.unlink(filename)
+        print "%6d definitions, %6.2f MB parsed in %6.3fs, peak memory %6.1f MB" % (
+            count, size / 1e6, elapsed, peak_memory())
+
+def bench_tokens():
+    source = generate_program(10000)
+    tokens, elapsed_objects = measure(lambda: tuple(lexer.tokenize_source(source)))
+    stream, elapsed_stream = measure(lexer.TokenStream, source)
+    object_bytes = sum(sys.getsizeof(token) + sys.getsizeof(token.__dict__) + sys.getsizeof(token.lexeme) for token in tokens)
+    stream_bytes = sum(column.buffer_info()[1] * column.itemsize for column in (stream.kinds, stream.starts, stream.ends, stream.lines, stream.columns))
+    print "%d tokens" % len(tokens)
+    print "Token objects: %6.1f bytes per token, lexed in %6.3fs" % (float(object_bytes) / len(tokens), elapsed_objects)
+    print "TokenStream:   %6.1f bytes per token, lexed in %6.3fs" % (float(stream_bytes) / len(stream), elapsed_stream)
+
+def bench_parser():
+    for definitions in 100, 200, 400, 10000:
+        tokens = tuple(lexer.tokenize_source(generate_program(definitions)))
+        if definitions <= 400:
+            # Parser copies the remaining tokens on every pop, don't try it on big inputs
+            result, elapsed = measure(lambda: Parser(*tokens).parse())
+            print "%6d definitions, %7d tokens, Parser:       %7.3fs" % (definitions, len(tokens), elapsed)
+        result, elapsed = measure(lambda: CursorParser(tokens).parse())
+        print "%6d definitions, %7d tokens, CursorParser: %7.3fs" % (definitions, len(tokens), elapsed)
+
+def bench_parallel():
+    source = generate_program(20000)
+    defs, sequential = measure(lambda: CursorParser(tuple(lexer.tokenize_source(source))).parse())
+    print "%d definitions, %d CPUs" % (len(defs[0]), cpu_count())
+    print "Sequential:            %6.3fs" % sequential
+    for processes in 1, 2, 4, 8:
+        defs, elapsed = measure(parparse.parse_source, source, processes)
+        print "Parallel, %d processes: %6.3fs, speedup %4.2fx" % (processes, elapsed, sequential / elapsed)
+
+def bench_astcache():
+    fd, filename = tempfile.mkstemp(suffix=".mo")
+    with os.fdopen(fd, "w") as fh:
+        fh.writelines(generate_lines(20000))
+    try:
+        for description in "Cold", "Warm":
+            (gctx, errors), elapsed = measure(astcache.front_end, filename)
+            print "%s start: %6.3fs for %d definitions" % (description, elapsed, len(gctx))
+        print "Cache file: %d bytes, source %d bytes" % (os.path.getsize(astcache.cache_filename(filename)), os.path.getsize(filename))
+    finally:
+        os.unlink(filename)
+        if os.path.exists(astcache.cache_filename(filename)):
+            os.unlink(astcache.cache_filename(filename))
+
+def bench_incremental():
+    source = generate_program(20000)
+    edited = source.replace("DEF f10000(x:nat, y:nat):nat == IF lt(x, y)", "DEF f10000(x:nat, y:nat):nat == IF lt(y, x)")
+    frontend = incremental.Frontend()
+    for description, text in ("Initial", source), ("Unchanged", source), ("One edit", edited):
+        result, elapsed = measure(frontend.check, text)
+        print "%-10s %6.3fs, parsed %5d and checked %5d definitions" % (description, elapsed, frontend.parsed, frontend.checked)
+
+def node_size(node, layout):
+    """
+    Size of the node in bytes including the parameter tuple of applications,
+    layout "dict" gives size of the same node with attributes in __dict__
+    """
+    size = sys.getsizeof(node)
+    if isinstance(node, absy.Apply):
+        size += sys.getsizeof(node.parameters)
+    if layout == "dict":
+        class Plain(object):
+            pass
+        plain = Plain()
+        for cls in node.__class__.__mro__:
+            for slot in getattr(cls, "__slots__", ()):
+                plain.__dict__[slot] = getattr(node, slot)
+        size += sys.getsizeof(plain) + sys.getsizeof(plain.__dict__) - sys.getsizeof(node)
+    return size
+
+def bench_ast():
+    source = generate_program(5000)
+    tokens = tuple(lexer.tokenize_source(source))
+    defs, state = CursorParser(tokens).parse()
+    interner = hashcons.Interner()
+    interned_defs, state = CursorParser(tokens, interner).parse()
+    nodes = [node for d in defs for node in absy.walk(d.body)]
+    unique = dict([(id(node), node) for d in interned_defs for node in absy.walk(d.body)]).values()
+    print "%d expression nodes, %d after hash-consing" % (len(nodes), len(unique))
+    print "Attributes in __dict__: %6.1f bytes per node" % (float(sum(node_size(node, "dict") for node in nodes)) / len(nodes))
+    print "Slots:                  %6.1f bytes per node" % (float(sum(node_size(node, "slots") for node in nodes)) / len(nodes))
+    print "Slots, hash-consed:     %6.1f bytes per node" % (float(sum(node_size(node, "slots") for node in unique)) / len(nodes))
+
+def bench_typing():
+    # Time per node should stay the same as the programs grow
+    for definitions in 10000, 20000, 40000:
+        defs, state = CursorParser(tuple(lexer.tokenize_source(generate_program(definitions)))).parse()
+        nodes = sum(1 for d in defs for node in absy.walk(d.body))
+        (gctx, errors), elapsed = measure(ctxcheck.context_check, defs)
+        print "%6d definitions, %7d nodes checked in %6.3fs: %5.2f us per node" % (
+            definitions, nodes, elapsed, elapsed / nodes * 1e6)
+
+def bench_coder():
+    # Time per instruction should stay the same as the programs grow
+    for definitions in 1000, 4000, 16000:
+        defs, state = CursorParser(tuple(lexer.tokenize_source(generate_program(definitions)))).parse()
+        gctx, errors = ctxcheck.context_check(defs)
+        instructions, elapsed = measure(coder.compile_program, gctx)
+        print "%6d definitions, %7d instructions issued in %6.3fs: %5.2f us per instruction" % (
+            definitions, len(instructions), elapsed, elapsed / len(instructions) * 1e6)
+
+def examples():
+    """
+    Generate file name and checked global context of every example
+    """
+    for filename in sorted(os.listdir(EXAMPLES)):
+        if filename.endswith(".mo"):
+            gctx, errors = astcache.front_end(os.path.join(EXAMPLES, filename))
+            yield filename, gctx
+
+def bench_peephole():
+    optimizer = peephole.Optimizer()
+    for filename, gctx in examples():
+        plain = coder.compile_program(gctx, optimize=False)
+        optimized = coder.compile_program(gctx, optimize=optimizer)
+        value, executed = uebb.execute(plain)
+        optimized_value, optimized_executed = uebb.execute(optimized)
+        assert value == optimized_value, "Optimized %s returned %d instead of %d" % (filename, optimized_value, value)
+        print "%-10s %3d -> %3d instructions, %5d -> %5d executed" % (
+            filename, len(plain), len(optimized), executed, optimized_executed)
+    print optimizer.report()
+
+def bench_partial():
+    # Little fuel runs out before recursive calls are evaluated, the default does not
+    for filename, gctx in examples():
+        counts = []
+        for fuel in None, 3, partial.DEFAULT_FUEL:
+            reduced = gctx if fuel is None else partial.reduce(gctx, fuel)
+            value, executed = uebb.execute(coder.compile_program(reduced))
+            counts.append(executed)
+        print "%-10s %5d instructions executed, %5d with fuel 3, %5d with fuel %d" % (
+            filename, counts[0], counts[1], counts[2], partial.DEFAULT_FUEL)
+
+def bench_inline():
+    for filename, gctx in examples():
+        inlined = inliner.Inliner(gctx)
+        value, executed = uebb.execute(coder.compile_program(gctx))
+        inlined_value, inlined_executed = uebb.execute(coder.compile_program(inlined.inline()))
+        assert value == inlined_value, "Inlined %s returned %d instead of %d" % (filename, inlined_value, value)
+        print "%-10s %2d calls inlined, %5d -> %5d instructions executed" % (
+            filename, inlined.removed, executed, inlined_executed)
+
+def bench_cse():
+    for filename, gctx in examples():
+        # Inlined bodies repeat the arguments of the functions inlined
+        gctx = inliner.inline(gctx)
+        eliminator = cse.Eliminator(gctx)
+        value, executed = uebb.execute(coder.compile_program(gctx, eliminate=False))
+        eliminated_value, eliminated_executed = uebb.execute(coder.compile_program(eliminator.eliminate(), eliminate=False))
+        assert value == eliminated_value, "%s returned %d instead of %d" % (filename, eliminated_value, value)
+        print "%-10s %2d subexpressions eliminated, %5d -> %5d instructions executed" % (
+            filename, eliminator.removed, executed, eliminated_executed)
+
+WORKLOADS = (
+    ("fib(22)", """DEF MAIN:nat == fib(22)
+DEF fib(n:nat):nat == IF lt(n, 2) THEN n ELSE add(fib(sub(n, 1)), fib(sub(n, 2))) FI
+"""),
+    ("fac(60) x 100", """DEF MAIN:nat == facs(100, 0)
+DEF facs(n:nat, s:nat):nat == IF eq(n, 0) THEN s ELSE facs(sub(n, 1), add(s, fac(60))) FI
+DEF fac(x:nat):nat == IF eq(x,0) THEN 1 ELSE mul(x, fac(sub(x,1))) FI
+"""),
+    ("sqrt x 200", """DEF MAIN:nat == roots(200, 0)
+DEF roots(n:nat, s:nat):nat == IF eq(n, 0) THEN s ELSE roots(sub(n, 1), add(s, sqrt(mul(n, 1000003)))) FI
+DEF sqrt(x:nat):nat == sqrt2(div(x,2),x)
+DEF sqrt2(guess:nat, x:nat):nat == IF good(guess,x) THEN guess ELSE sqrt2(improve(guess,x),x) FI
+DEF good(guess:nat, x:nat):bool == eq(improve(guess,x),guess)
+DEF improve(guess:nat, x:nat):nat == average(guess,div(x,guess))
+DEF average(x:nat, y:nat):nat == div(add(x,y),2)
+"""),
+)
+
+def check_workload(source):
+    defs, state = CursorParser(tuple(lexer.tokenize_source(source))).parse()
+    gctx, errors = ctxcheck.context_check(defs)
+    if errors:
+        raise RuntimeError("Workload has errors: %s" % ", ".join([msg for token, msg in errors]))
+    return gctx
+
+def main_of(functions):
+    main = functions["MAIN"]
+    return lambda: main(())
+
+# Backend name to function which compiles global context to callable returning value of MAIN
+BACKENDS = {
+    "tree walker": lambda gctx: lambda: gctx["MAIN"].evaluate((), gctx),
+    "closures": lambda gctx: main_of(closures.compile_program(gctx)),
+    "eager": lambda gctx: main_of(closures.compile_program(gctx, tail_calls=False)),
+    "lazy": lambda gctx: main_of(lazy.compile_program(gctx)),
+    "Python source": lambda gctx: pycoder.load(pycoder.translate(gctx))["MAIN"],
+}
+
+def compare(baseline, backends):
+    """
+    Time backends against baseline on every workload, compile time of
+    the backends is reported separately
+    """
+    for description, source in WORKLOADS:
+        gctx = check_workload(source)
+        expected, elapsed_baseline = measure(BACKENDS[baseline](gctx))
+        print "%-13s %-13s %6.3fs" % (description, baseline, elapsed_baseline)
+        for name in backends:
+            main, elapsed_compile = measure(BACKENDS[name], gctx)
+            result, elapsed = measure(main)
+            assert result == expected, "%s returned %d instead of %d" % (name, result, expected)
+            print "%-13s %-13s %6.3fs + %6.4fs compile, speedup %4.1fx" % (
+                "", name, elapsed, elapsed_compile, elapsed_baseline / elapsed)
+
+def bench_backends():
+    compare("tree walker", sorted([name for name in BACKENDS if name != "tree walker"]))
+
+def bench_closures():
+    compare("tree walker", ["closures"])
+
+def bench_tailcalls():
+    # Without tail calls every iteration takes two Python frames, stay below the limit
+    source = """DEF MAIN:nat == loops(150, 0)
+DEF loops(n:nat, s:nat):nat == IF eq(n, 0) THEN s ELSE loops(sub(n, 1), add(s, sum(250, 0))) FI
+DEF sum(x:nat, y:nat):nat == IF eq(x, 0) THEN y ELSE sum(sub(x,1), add(y,x)) FI
+"""
+    gctx = check_workload(source)
+    for tail_calls in False, True:
+        main = closures.compile_program(gctx, tail_calls)["MAIN"]
+        result, elapsed = measure(lambda: [main(()) for i in xrange(20)])
+        print "20 x 150 x sum(250, 0), tail calls %-5s %6.3fs" % (tail_calls, elapsed)
+    deep = check_workload("""DEF MAIN:nat == sum(1000000, 0)
+DEF sum(x:nat, y:nat):nat == IF eq(x, 0) THEN y ELSE sum(sub(x,1), add(y,x)) FI
+""")
+    result, elapsed = measure(closures.compile_program(deep)["MAIN"], ())
+    print "sum(1000000, 0) = %d with tail calls in %6.3fs, stack depth limit %d" % (result, elapsed, sys.getrecursionlimit())
+
+def bench_memo():
+    for n in 20, 25, 100:
+        gctx = check_workload("""DEF MAIN:nat == fib(%d)
+DEF fib(n:nat):nat == IF lt(n, 2) THEN n ELSE add(fib(sub(n, 1)), fib(sub(n, 2))) FI
+""" % n)
+        if n <= 25:
+            result, elapsed = measure(closures.compile_program(gctx)["MAIN"], ())
+            print "fib(%d) without memoization: %8.4fs" % (n, elapsed)
+        caches = memo.caches(gctx, ["fib"], 64)
+        result, elapsed = measure(closures.compile_program(gctx, memoize=caches)["MAIN"], ())
+        print "fib(%d) memoized:            %8.4fs, %d hits, %d misses, %d evictions" % (
+            n, elapsed, caches["fib"].hits, caches["fib"].misses, caches["fib"].evictions)
+
+def bench_pycoder():
+    compare("closures", ["Python source"])
+
+def bench_batch():
+    gctx = check_workload(WORKLOADS[-1][1] + """DEF sum(x:nat, y:nat):nat == IF eq(x, 0) THEN y ELSE sum(sub(x,1), add(y,x)) FI
+DEF fac(x:nat):nat == IF eq(x,0) THEN 1 ELSE mul(x, fac(sub(x,1))) FI
+DEF facsum(x:nat):nat == add(fac(mod(x)), sum(x, 0))
+DEF mod(x:nat):nat == sub(x, mul(div(x, 20), 20))
+DEF power6(x:nat):nat == mul(x, mul(x, mul(x, mul(x, mul(x, x)))))
+""")
+    for name, lanes in ("sqrt", 50000), ("sum", 5000), ("facsum", 5000), ("power6", 2000):
+        # Integer Newton iteration may oscillate, squares from 4 on are safe
+        columns = [[i * i if name == "sqrt" else i for i in xrange(2, lanes + 2)]] * len(gctx[name].args)
+        evaluator = batch.BatchEvaluator(gctx)
+        results, elapsed_batch = measure(evaluator.evaluate, name, *columns)
+        function = closures.compile_program(gctx, root=name)[name]
+        expected, elapsed_loop = measure(lambda: [function(lane) for lane in zip(*columns)])
+        assert list(results) == expected
+        print "%-7s %6d lanes: batch %6.3fs, per call loop %6.3fs, speedup %5.1fx, %d lanes evaluated one by one" % (
+            name, lanes, elapsed_batch, elapsed_loop, elapsed_loop / elapsed_batch, evaluator.fallbacks)
+
+def bench_pareval():
+    gctx = check_workload("""DEF MAIN:nat == add(fib(25), fac(200))
+DEF fib(n:nat):nat == IF lt(n, 2) THEN n ELSE add(fib(sub(n, 1)), fib(sub(n, 2))) FI
+DEF fac(x:nat):nat == IF eq(x,0) THEN 1 ELSE mul(x, fac(sub(x,1))) FI
+""")
+    expected, sequential = measure(closures.compile_program(gctx)["MAIN"], ())
+    print "fib(25) + fac(200), %d CPUs" % cpu_count()
+    print "Sequential:            %6.3fs" % sequential
+    for processes in 2, 4, 8:
+        evaluator = pareval.ParallelEvaluator(gctx)
+        result, elapsed = measure(evaluator.run, processes)
+        assert result == expected
+        print "Parallel, %d processes: %6.3fs, speedup %4.2fx, %d tasks" % (processes, elapsed, sequential / elapsed, evaluator.tasks)
+
+def bench_lazy():
+    gctx = check_workload("""DEF MAIN:nat == loop(300, 0)
+DEF loop(n:nat, s:nat):nat == IF eq(n, 0) THEN s ELSE loop(sub(n, 1), add(s, pick(mod(n), fib(18), n))) FI
+DEF pick(c:nat, x:nat, y:nat):nat == IF eq(c, 0) THEN x ELSE y FI
+DEF mod(x:nat):nat == sub(x, mul(div(x, 100), 100))
+DEF fib(n:nat):nat == IF lt(n, 2) THEN n ELSE add(fib(sub(n, 1)), fib(sub(n, 2))) FI
+""")
+    print "Strict arguments:", ", ".join(["%s%s" % (name, flags) for name, flags in sorted(lazy.strictness(gctx).items())])
+    expected, elapsed_eager = measure(closures.compile_program(gctx)["MAIN"], ())
+    result, elapsed_lazy = measure(lazy.compile_program(gctx)["MAIN"], ())
+    assert result == expected
+    print "Expensive argument used 3 times out of 300: eager %6.3fs, lazy %6.3fs, speedup %5.1fx" % (elapsed_eager, elapsed_lazy, elapsed_eager / elapsed_lazy)
+    # All arguments are strict in the workloads
+    compare("eager", ["lazy"])
+
+BENCHMARKS = {
+    "ast": bench_ast,
+    "batch": bench_batch,
+    "astcache": bench_astcache,
+    "backends": bench_backends,
+    "closures": bench_closures,
+    "coder": bench_coder,
+    "cse": bench_cse,
+    "incremental": bench_incremental,
+    "inline": bench_inline,
+    "lazy": bench_lazy,
+    "lexer": bench_lexer,
+    "memo": bench_memo,
+    "parallel": bench_parallel,
+    "pareval": bench_pareval,
+    "parser": bench_parser,
+    "partial": bench_partial,
+    "peephole": bench_peephole,
+    "pycoder": bench_pycoder,
+    "stream": bench_stream,
+    "tailcalls": bench_tailcalls,
+    "tokens": bench_tokens,
+    "typing": bench_typing,
+}
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or sorted(BENCHMARKS):
+        print "###", name
+        BENCHMARKS[name]()
+        print
@@ -9,7 +9,7 @@ import ir
 
 class DefinitionEq(DefinitionBuiltin):
     name = "eq"
-    return_type = "nat"
+    return_type = "bool"
     args = ("a", "nat"), ("b", "nat")
     
     def evaluate(self, parameters, gctx):
@@ -45,7 +45,7 @@ class DefinitionAdd(DefinitionBuiltin):
 
 class DefinitionLessThan(DefinitionBuiltin):
     name = "lt"
-    return_type = "nat"
+    return_type = "bool"
     args = ("a", "nat"), ("b", "nat")
     
     def evaluate(self, parameters, gctx):
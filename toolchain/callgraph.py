@@ -0,0 +1,138 @@
+# coding: utf-8
+"""
+Call graph of checked program, edges are collected from function
+applications in definition bodies. Built-in functions are not part of
+the graph. Strongly connected components are groups of mutually
+recursive functions, they are listed bottom-up so that callees come
+before their callers:
+
+    graph = CallGraph(gctx)
+    for component in graph.components:
+        ...
+"""
+
+import sys
+import absy
+
+class CallGraph(object):
+    def __init__(self, gctx, root="MAIN"):
+        self.gctx = gctx
+        self.root = root
+        self.calls = {} # Function name to names of functions it calls
+        for name, d in gctx.iteritems():
+            if isinstance(d, absy.DefinitionBuiltin):
+                continue
+            callees = []
+            for node in absy.walk(d.body):
+                if isinstance(node, absy.Apply) and node.func_name not in callees:
+                    f = gctx.get(node.func_name)
+                    if f is not None and not isinstance(f, absy.DefinitionBuiltin):
+                        callees.append(node.func_name)
+            self.calls[name] = tuple(callees)
+        self.reachable = self.reachable_from(root)
+        self.components = self.strongly_connected_components()
+        self.component = {} # Function name to its component
+        for component in self.components:
+            for name in component:
+                self.component[name] = component
+        self.leaves = frozenset([name for name, callees in self.calls.iteritems() if not callees])
+
+    def reachable_from(self, name):
+        """
+        Names of functions that can be called starting from function name
+        """
+        if name not in self.calls:
+            return frozenset()
+        seen = set([name])
+        stack = [name]
+        while stack:
+            for callee in self.calls[stack.pop()]:
+                if callee not in seen:
+                    seen.add(callee)
+                    stack.append(callee)
+        return frozenset(seen)
+
+    def strongly_connected_components(self):
+        """
+        Tarjan's algorithm without recursion, components are returned
+        in the order they are completed which is bottom-up
+        """
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        components = []
+        for start in sorted(self.calls):
+            if start in index:
+                continue
+            work = [(start, 0)]
+            while work:
+                name, i = work.pop()
+                if i == 0:
+                    index[name] = lowlink[name] = len(index)
+                    stack.append(name)
+                    on_stack.add(name)
+                callees = self.calls[name]
+                if i < len(callees):
+                    work.append((name, i + 1))
+                    callee = callees[i]
+                    if callee not in index:
+                        work.append((callee, 0))
+                    elif callee in on_stack:
+                        lowlink[name] = min(lowlink[name], index[callee])
+                    continue
+                if lowlink[name] == index[name]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == name:
+                            break
+                    components.append(tuple(component))
+                if work:
+                    caller = work[-1][0]
+                    lowlink[caller] = min(lowlink[caller], lowlink[name])
+        return components
+
+    def is_recursive(self, name):
+        """
+        Whether function can call itself directly or through other functions
+        """
+        return len(self.component[name]) > 1 or name in self.calls[name]
+
+    def is_leaf(self, name):
+        return name in self.leaves
+
+    def is_reachable(self, name):
+        return name in self.reachable
+
+    def unreachable(self):
+        """
+        Names of definitions that can never be called from the root
+        """
+        return frozenset([name for name in self.calls if name not in self.reachable])
+
+def prune(gctx, root="MAIN"):
+    """
+    Return global context without definitions unreachable from the root
+    """
+    graph = CallGraph(gctx, root)
+    return dict([(name, d) for name, d in gctx.iteritems() if name not in graph.calls or name in graph.reachable])
+
+if __name__ == "__main__":
+    import astcache
+    filename, = sys.argv[1:]
+    gctx, errors = astcache.front_end(filename)
+    if errors:
+        for node, msg in errors:
+            print msg, "on line", node.line, "column", node.column
+    else:
+        graph = CallGraph(gctx)
+        for component in graph.components:
+            notes = []
+            if graph.is_recursive(component[0]):
+                notes.append("recursive")
+            if not graph.is_reachable(component[0]):
+                notes.append("unreachable")
+            print ", ".join(component), "(%s)" % ", ".join(notes) if notes else ""
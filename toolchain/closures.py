@@ -0,0 +1,196 @@
+# coding: utf-8
+"""
+Closure compiling interpreter, every checked definition is turned into
+nested Python closures once. Variables are resolved to argument slots and
+callees are bound through cells, so evaluation does no dictionary lookups.
+A compiled function takes the tuple of its arguments:
+
+    functions = compile_program(gctx)
+    functions["MAIN"](())
+
+Calls in tail position are not made by the caller, instead the body
+returns the arguments to a trampoline loop of the function which was
+called last. A call to the function itself returns the argument tuple,
+a call to another function returns a list of its body and the arguments.
+Values are never tuples or lists, which tells tail calls apart from
+results. Tail recursive loops thus run in constant Python stack.
+"""
+
+import sys
+from operator import itemgetter
+import absy
+import astcache
+import builtin
+import callgraph
+import memo
+
+BUILTIN_MAPPING = {
+    builtin.DefinitionEq:       lambda a, b: lambda env: a(env) == b(env),
+    builtin.DefinitionLessThan: lambda a, b: lambda env: a(env) < b(env),
+    builtin.DefinitionAdd:      lambda a, b: lambda env: a(env) + b(env),
+    builtin.DefinitionSub:      lambda a, b: lambda env: a(env) - b(env),
+    builtin.DefinitionMul:      lambda a, b: lambda env: a(env) * b(env),
+    builtin.DefinitionDiv:      lambda a, b: lambda env: a(env) / b(env)
+}
+
+def constant(value):
+    return lambda env: value
+
+def call(cell, parameters):
+    """
+    Closure calling function in cell, common arities get their own closures
+    """
+    if not parameters:
+        return lambda env: cell[0](())
+    if len(parameters) == 1:
+        a, = parameters
+        return lambda env: cell[0]((a(env),))
+    if len(parameters) == 2:
+        a, b = parameters
+        return lambda env: cell[0]((a(env), b(env)))
+    if len(parameters) == 3:
+        a, b, c = parameters
+        return lambda env: cell[0]((a(env), b(env), c(env)))
+    return lambda env: cell[0](tuple([p(env) for p in parameters]))
+
+def tail_call(cell, parameters, itself):
+    """
+    Closure returning arguments and, unless calling itself, body in cell
+    for the trampoline
+    """
+    if itself:
+        if len(parameters) == 1:
+            a, = parameters
+            return lambda env: (a(env),)
+        if len(parameters) == 2:
+            a, b = parameters
+            return lambda env: (a(env), b(env))
+        return lambda env: tuple([p(env) for p in parameters])
+    if len(parameters) == 1:
+        a, = parameters
+        return lambda env: [cell[0], (a(env),)]
+    if len(parameters) == 2:
+        a, b = parameters
+        return lambda env: [cell[0], (a(env), b(env))]
+    return lambda env: [cell[0], tuple([p(env) for p in parameters])]
+
+def trampoline(body):
+    """
+    Function running body and the bodies it tail calls in a loop
+    """
+    def function(env):
+        current = body
+        while True:
+            result = current(env)
+            while type(result) is tuple:
+                result = current(result)
+            if type(result) is not list:
+                return result
+            current, env = result
+    return function
+
+def conditional(expr_if, expr_then, expr_else):
+    return lambda env: expr_then(env) if expr_if(env) else expr_else(env)
+
+def compile_definition(d, gctx, cells, bodies=None, memoized=()):
+    """
+    Return closure evaluating body of definition d, children are compiled
+    before their parents without recursion. If bodies are given, calls in
+    tail position return the callee's body from bodies and the arguments,
+    except for memoized functions which are always called through cells
+    """
+    slots = dict([(arg_name, index) for index, (arg_name, arg_type) in enumerate(d.args)])
+    compiled = {}
+    # Shared nodes may be compiled twice, once for tail position
+    stack = [(d.body, bodies is not None, False)]
+    while stack:
+        node, tail, expanded = stack.pop()
+        key = id(node), tail
+        if key in compiled:
+            continue
+        children = node.children()
+        if isinstance(node, absy.Conditional):
+            tails = (False,) + (tail,) * (len(children) - 1)
+        else:
+            tails = (False,) * len(children)
+        if not expanded and children:
+            stack.append((node, tail, True))
+            stack.extend([(child, child_tail, False) for child, child_tail in zip(children, tails)])
+            continue
+        children = [compiled[id(child), child_tail] for child, child_tail in zip(children, tails)]
+
+        if isinstance(node, absy.Variable):
+            compiled[key] = itemgetter(slots[node.name])
+        elif isinstance(node, absy.Value):
+            compiled[key] = constant(node.value)
+        elif isinstance(node, absy.Apply):
+            f = gctx[node.func_name]
+            if isinstance(f, absy.DefinitionBuiltin):
+                compiled[key] = BUILTIN_MAPPING[f.__class__](*children)
+            elif tail and node.func_name not in memoized:
+                compiled[key] = tail_call(bodies[node.func_name], children, node.func_name == d.name)
+            else:
+                compiled[key] = call(cells[node.func_name], children)
+        elif isinstance(node, absy.Conditional):
+            if len(children) < 3:
+                raise Exception("Conditional without ELSE can not be compiled")
+            compiled[key] = conditional(*children)
+        else:
+            raise Exception("Don't know how to compile: %s of class %s" % (node, node.__class__.__name__))
+    return compiled[id(d.body), bodies is not None]
+
+def has_tail_calls(d, gctx, memoized=()):
+    """
+    Whether definition body calls user defined function in tail position
+    """
+    stack = [d.body]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, absy.Conditional):
+            stack.extend(node.children()[1:])
+        elif isinstance(node, absy.Apply):
+            if not isinstance(gctx[node.func_name], absy.DefinitionBuiltin) and node.func_name not in memoized:
+                return True
+    return False
+
+def compile_program(gctx, tail_calls=True, memoize=None, root="MAIN"):
+    """
+    Compile definitions reachable from root, return dictionary of function
+    name to compiled function. Functions making tail calls are wrapped in
+    trampolines unless tail_calls is disabled. Functions named in memoize
+    remember their results in the caches memoize maps them to
+    """
+    memoize = memoize or {}
+    graph = callgraph.CallGraph(gctx, root)
+    cells = dict([(name, [None]) for name in graph.reachable])
+    if not tail_calls:
+        for name in graph.reachable:
+            cells[name][0] = compile_definition(gctx[name], gctx, cells)
+    else:
+        bodies = dict([(name, [None]) for name in graph.reachable])
+        for name in graph.reachable:
+            bodies[name][0] = body = compile_definition(gctx[name], gctx, cells, bodies, memoize)
+            cells[name][0] = trampoline(body) if has_tail_calls(gctx[name], gctx, memoize) else body
+    for name, cache in memoize.iteritems():
+        if name in cells:
+            cells[name][0] = memo.memoized(cells[name][0], cache)
+    return dict([(name, cell[0]) for name, cell in cells.iteritems()])
+
+def interpret(filename, tail_calls=True, memoize=None):
+    """
+    Evaluate MAIN of the source file, functions named in memoize are
+    memoized, memoize=True memoizes all of them and caches made by
+    memo.caches are used as they are
+    """
+    gctx, errors = astcache.front_end(filename)
+
+    if errors:
+        for node, msg in errors:
+            print msg, "on line", node.line, "column", node.column
+
+    else:
+        return compile_program(gctx, tail_calls, memo.select(gctx, memoize))["MAIN"](())
+
+if __name__ == "__main__":
+    filename, = sys.argv[1:]
+    print "The MAIN function returned:", interpret(filename)
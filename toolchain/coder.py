@@ -4,12 +4,21 @@
 """
 
 import sys
-import lexer
-from parser import Parser
-from ctxcheck import context_check
+import astcache
 import absy
 import ir
 import builtin
+import callgraph
+import cse
+import inliner
+import partial
+import peephole
+
+# Conditions compiled to compare and branch instructions
+BRANCH_MAPPING = {
+    builtin.DefinitionEq:         ir.JumpEqual,
+    builtin.DefinitionLessThan:   ir.JumpLessThan
+}
 
 BUILTIN_MAPPING = {
     builtin.DefinitionEq:         ir.Eq,
@@ -20,162 +29,251 @@ BUILTIN_MAPPING = {
     builtin.DefinitionDiv:        ir.Div
 }
 
-def elaborate(func):
-    def wrapped(old_env, node):
-        env = func(old_env, node)
-        print "Compiled node", node, "to", env.instructions[-len(env.instructions)+len(old_env.instructions):]
-        print "=> Stack:", env.stack
-        return env
-    return wrapped
-
 class Environment(object):
     """
     Environment holds compiler state: what functions are available,
     what's in the stack and what instructions have been issued so far.
+    Instructions are appended to a buffer which can be shared by
+    environments of several functions, the stack is updated in place.
     """
-    def __init__(self, gctx, stack=(), instructions=()):
+    def __init__(self, gctx, stack=(), instructions=None):
         self.gctx = gctx
-        self.stack = stack
-        self.instructions = instructions
-        
+        self.stack = list(stack)
+        self.instructions = [] if instructions is None else instructions
+        self.labels = 0 # Number of conditionals compiled, used for label names
+
     def push_constant(env, constant):
         constant = int(constant) # Coarse True/False to 1/0
-        return Environment(env.gctx, env.stack + (constant,), env.instructions + (ir.PushInt(constant),))
-    
+        env.stack.append(constant)
+        env.instructions.append(ir.PushInt(constant))
+        return env
+
     def push_var(env, name):
         if name not in env.stack: raise Exception("Variable not present in stack!")
         # Find the first instance of the variable on the stack
         offset = len(env.stack) - env.stack.index(name) - 1
-        return Environment(env.gctx, env.stack + (name,), env.instructions + (ir.Push(offset),))
+        env.stack.append(name)
+        env.instructions.append(ir.Push(offset))
+        return env
 
     def push(self, instruction):
-        
         stack = self.stack
         if isinstance(instruction, ir.BinaryOperator): # Do this for builtins such as add, mul, div, sub
-            stack = stack[:-2] + ("%s%s" % (instruction.mnemonic, id(self)),)
+            stack[-2:] = ["<%s>" % instruction.mnemonic]
         elif isinstance(instruction, ir.PushAddr):
-            stack = stack + ("CallAddr%s%dx" % (instruction.mnemonic, id(self)),)
+            stack.append("<CallAddr%s>" % instruction.target)
         elif isinstance(instruction, ir.Call):
             # For the caller it looks like the call address gets popped and substituted with return value
-            stack = stack[:-1] + ("CallReturnValue%d" % id(self),)
+            stack[-1] = "<CallReturnValue>"
         elif isinstance(instruction, ir.Return):
             # Returning from function pops the return address from stack which is exactly before return value
-            stack = stack[:-2] + stack[-1:]
+            del stack[-2]
+        elif isinstance(instruction, ir.Store):
+            stack.pop()
         elif isinstance(instruction, ir.Slide):
             assert len(stack) > instruction.offset, "Stack is %s, attempted to slide by %d" % (stack, instruction.offset)
-            stack = stack[:-instruction.offset-1] + stack[-1:]
-        print "Issued instruction", instruction #, "stack was:", self.stack,
-        print "=> Stack:", stack
-        return Environment(self.gctx, stack, self.instructions + (instruction,))
-        
+            del stack[-instruction.offset-1:-1]
+        self.instructions.append(instruction)
+        return self
+
     def __iter__(self):
         return iter(self.instructions)
-        
-    def compile(env, node):
-        if isinstance(node, absy.Variable):
-            # is is further in stack push i-th node
-            return env.push_var(node.name)
-            
-        elif isinstance(node, absy.Nat) or isinstance(node, absy.Boolean):
-            return env.push_constant(node.value)
-
-        elif isinstance(node, absy.Apply):
-            # Resolve function definition
-            d = env.gctx[node.func_name]
-            
-            assert len(node.parameters) == len(d.args), "Invalid invocation of %s" % node.func_name
-
-            # Push function application arguments to stack            
-            for param in  node.parameters:
-                env = env.compile(param)
-#                print "Pushed function call parameter:", param, "stack is now:", env.stack
-            
-            if isinstance(d, absy.DefinitionBuiltin):
-                for dc, ic in BUILTIN_MAPPING.iteritems():
-                    if  isinstance(d, dc):
-                        instruction = ic()
-                        if isinstance(instruction, ir.Sub) or isinstance(instruction, ir.Div): # TODO Builtins are swappe in Machine JAR
-                            env = env.push(ir.Swap())
-                        return env.push(instruction)
-                raise Exception("Don't know how to compile built-in %s" % d.name)
+
+    def compile(env, node, function=None):
+        """
+        Issue instructions for expression, work list is used instead of
+        recursion: it holds nodes to compile and instructions to issue
+        in between them. If expression is the body of function, calls
+        of the function in tail position overwrite the arguments and
+        jump back to the beginning of the function
+        """
+        work = [("tail" if function else "compile", node)]
+        then_stacks = [] # Stacks left by then branches whose else branch is being compiled
+        while work:
+            action, item = work.pop()
+
+            if action == "push":
+                env.push(item)
+                continue
+
+            if action == "restore":
+                # Stack persists for both branches, the else branch starts from the same stack
+                env.stack[:] = item
+                continue
+
+            if action == "then":
+                then_stacks.append(list(env.stack))
+                continue
+
+            if action == "merge":
+                then_stack = then_stacks.pop()
+                assert len(then_stack) == len(env.stack), "This should not happen, %s in then stack and %s in else stack" % (then_stack, env.stack)
+                continue
+
+            if action == "bind":
+                # Value of the let expression stays in the stack under the name
+                env.stack[-1] = item
+                continue
+
+            if action == "tail_call":
+                # Values of changed arguments are on top of stack, last one topmost
+                changed, stack = item
+                temporaries = len(stack) - len(env.gctx[function].args) - 1
+                for index in reversed(changed):
+                    if index == changed[0] and temporaries:
+                        # Values bound by let are not needed any more, only the last value is above them
+                        env.push(ir.Slide(temporaries))
+                    env.push(ir.Store(len(env.stack) - 2 - index))
+                env.push(ir.Jump(ir.Label(function)))
+                env.stack[:] = stack + ["<TailCall>"] # Never pushed, keeps branches of equal height
+                continue
+
+            if action == "branch":
+                jump, popped, first, second, label_second, label_fi, tail = item
+                # Pop operands of the jump, branches push the value of conditional
+                stack = env.stack[:-popped]
+                env.push(jump)
+                env.stack[:] = stack
+                work.extend(reversed([
+                    (tail, first),
+                    ("push", ir.Jump(label_fi)),
+                    ("then", None),
+                    ("restore", stack),
+                    ("push", label_second),
+                    (tail, second),
+                    ("push", label_fi),
+                    ("merge", None)]))
+                continue
+
+            node = item
+            # Function without arguments can not get rid of values bound by let before jumping
+            if action == "tail" and isinstance(node, absy.Apply) and node.func_name == function and \
+                    (node.parameters or len(env.stack) == 1):
+                d = env.gctx[function]
+                assert len(node.parameters) == len(d.args), "Invalid invocation of %s" % node.func_name
+                # Arguments passed on as they are need not be stored unless values bound by let have to be slid off
+                changed = [index for index, (param, (arg_name, arg_type)) in enumerate(zip(node.parameters, d.args))
+                    if not isinstance(param, absy.Variable) or param.name != arg_name]
+                if not changed and len(env.stack) > len(d.args) + 1:
+                    changed = [0]
+                work.append(("tail_call", (changed, list(env.stack))))
+                work.extend(reversed([("compile", node.parameters[index]) for index in changed]))
+
+            elif isinstance(node, absy.Variable):
+                # is is further in stack push i-th node
+                env.push_var(node.name)
+
+            elif isinstance(node, absy.Nat) or isinstance(node, absy.Boolean):
+                env.push_constant(node.value)
+
+            elif isinstance(node, absy.Apply):
+                # Resolve function definition
+                d = env.gctx[node.func_name]
+
+                assert len(node.parameters) == len(d.args), "Invalid invocation of %s" % node.func_name
+
+                if isinstance(d, absy.DefinitionBuiltin):
+                    for dc, ic in BUILTIN_MAPPING.iteritems():
+                        if isinstance(d, dc):
+                            instruction = ic()
+                            break
+                    else:
+                        raise Exception("Don't know how to compile built-in %s" % d.name)
+                    instructions = [instruction]
+                    if isinstance(instruction, ir.Sub) or isinstance(instruction, ir.Div): # TODO Builtins are swappe in Machine JAR
+                        instructions.insert(0, ir.Swap())
+                else:
+                    instructions = [ir.PushAddr(node.func_name), ir.Call(), ir.Slide(len(node.parameters))]
+
+                # Push function application arguments to stack, then issue the instructions
+                work.extend(reversed([("compile", param) for param in node.parameters] + [("push", i) for i in instructions]))
+
+            elif isinstance(node, absy.Conditional):
+                env.labels += 1
+                # Dot can not appear in function names, so these can not collide with them
+                label_then = ir.Label(".then%d" % env.labels)
+                label_else = ir.Label(".else%d" % env.labels)
+                label_fi = ir.Label(".fi%d" % env.labels)
+                tail = "tail" if action == "tail" else "compile"
+                condition = node.expr_if
+                f = env.gctx[condition.func_name] if isinstance(condition, absy.Apply) else None
+                if f.__class__ in BRANCH_MAPPING:
+                    # Operands are compared by the jump, which takes the then branch laid out second
+                    operands = list(condition.parameters)
+                    zero = [p for p in operands if isinstance(p, absy.Nat) and p.value == 0]
+                    if isinstance(f, builtin.DefinitionEq) and zero:
+                        operands.remove(zero[0])
+                        jump = ir.ConditionalJump(label_then)
+                    else:
+                        jump = BRANCH_MAPPING[f.__class__](label_then)
+                    work.append(("branch", (jump, len(operands), node.expr_else, node.expr_then, label_then, label_fi, tail)))
+                    work.extend(reversed([("compile", p) for p in operands]))
+                else:
+                    # Jz takes the else branch when the condition evaluates to 0
+                    work.append(("branch", (ir.ConditionalJump(label_else), 1, node.expr_then, node.expr_else, label_else, label_fi, tail)))
+                    work.append(("compile", condition))
+
+            elif isinstance(node, absy.Let):
+                # Value stays in the stack while body is evaluated, then it is slid off
+                work.extend(reversed([
+                    ("compile", node.expr_value),
+                    ("bind", node.name),
+                    (action, node.expr_body),
+                    ("push", ir.Slide(1))]))
 
             else:
-                print "Compiling function call of", node.func_name
-                return env.push(ir.PushAddr(node.func_name)).push(ir.Call()).push(ir.Slide(len(node.parameters)))
-            
-        elif isinstance(node, absy.Conditional):
-            print "Compiling conditional if-expression"
-            label_else = ir.Label("else%d" % id(env))
-            label_fi = ir.Label("fi%d" % id(env))
-            
-            # If the expr_if is eq(_, 0) then we can skip some stuff
-            optimize = isinstance(node.expr_if, absy.Apply) and node.expr_if.func_name == "eq" and isinstance(node.expr_if.parameters[1], absy.Nat) and node.expr_if.parameters[1].value == 0
-            
-            if not optimize:
-                env = env.push(ir.PushInt(0))
-            
-            env = env.compile(node.expr_if)
-                
-            if not optimize:
-                env = env.push(ir.Eq()) # Compare 0 to number previously on top of stack
-
-            # Stack persists for both branches, start from scratch for instructions
-            env_then = Environment(env.gctx, env.stack[:-1], ()).push(ir.ConditionalJump(label_else)).compile(node.expr_then).push(ir.Jump(label_fi))
-            env_else = Environment(env.gctx, env.stack[:-1], ()).push(label_else).compile(node.expr_else).push(label_fi)
-            assert len(env_then.stack) == len(env_else.stack), "This should not happen, %s in then stack and %s in else stack" % (env_then.stack, env_else.stack)
-            
-            # Pop if-expression value and push then-else expression value placeholder
-            stack = env.stack[:-1] + ("cond%d" % id(env),)
-            
-            # Merge instruction branches and add placeholder for conditional return value
-            instructions = env.instructions + env_then.instructions + env_else.instructions
-            print "Merging conditional branches"
-#            return Environment(env.gctx, stack, )
-            return Environment(env.gctx, env.stack, env.instructions + env_then.instructions + env_else.instructions)
+                raise Exception("Don't know how to compile: %s of class %s" % (node, node.__class__.__name__))
+        return env
 
+
+def compile_program(gctx, optimize=True, eliminate=True):
+    """
+    Return instructions of the program, functions are compiled to
+    a single buffer and labels are resolved to offsets in two passes.
+    Peephole optimizer rewrites the instructions before that unless
+    optimize is False, optimize can be peephole.Optimizer with own rules.
+    Common subexpressions are evaluated once unless eliminate is False
+    """
+    if eliminate:
+        gctx = cse.eliminate(gctx)
+    instructions = []
+    env = Environment(gctx, (), instructions)
+    env.compile(gctx["MAIN"].body)
+    instructions.append(ir.Stop())
+    graph = callgraph.CallGraph(gctx)
+    for label, d in gctx.iteritems():
+        if label in graph.reachable and label != "MAIN":
+            instructions.append(ir.Label(label))
+            arg_names = tuple([arg_name for arg_name, arg_type in d.args])
+            env.stack[:] = arg_names + ("ReturnAddress",)
+            env.compile(d.body, label).push(ir.Return())
+
+    if optimize:
+        optimizer = peephole.Optimizer() if optimize is True else optimize
+        instructions = optimizer.optimize(instructions)
+
+    # First pass finds offsets of labels and drops them, second one resolves jumps
+    offsets = {}
+    program = []
+    for i in instructions:
+        if isinstance(i, ir.Label):
+            offsets[i.name] = len(program)
         else:
-            raise Exception("Don't know how to compile: %s of class %s" % (node, node.__class__.__name__))
-
-            
-def compile_program(gctx):
-    def compile_with_labels():
-        print "Compiling function MAIN"
-        for i  in Environment(gctx).compile(gctx["MAIN"].body):
-            print i
-            yield i
-        yield ir.Stop()
-        print
-        for label, d in gctx.iteritems():
-            if not isinstance(d, absy.DefinitionBuiltin) and label != "MAIN":
-                print "Compiling function", label
-                yield ir.Label(label)
-                arg_names = tuple([arg_name for arg_name, arg_type in d.args])
-                for i in Environment(gctx, arg_names + ("ReturnAddress",)).compile(d.body).push(ir.Return()):
-                    print i
-                    yield i
-                print
-
-    def scrub():
-        offsets = {}
-        instructions = ()
-        j = 0
-        for i in compile_with_labels():
-            if isinstance(i, ir.Label):
-                offsets[i.name] = j
-            else:
-                instructions = instructions + (i,)
-                j += 1
-        for i in instructions:
-            if isinstance(i, ir.PushAddr) or isinstance(i, ir.Jump):
-                i.target = offsets[i.target]
-        return instructions
-            
-    return scrub()
-    
-def uebb_compile(filename):
-    tokens = tuple(lexer.tokenize(filename))
-    defs, state = Parser(*tokens).parse()
-    gctx, errors = context_check(defs)
+            program.append(i)
+    for i in program:
+        if isinstance(i, ir.PushAddr) or isinstance(i, ir.Jump):
+            i.target = offsets[i.target]
+    return tuple(program)
+
+def uebb_compile(filename, fuel=None, inline=False):
+    """
+    Write instructions for the source file next to it, program is
+    partially evaluated first if fuel is given and small functions are
+    inlined if inline is set
+    """
+    gctx, errors = astcache.front_end(filename) if fuel is None else partial.front_end(filename, fuel)
+    if inline and not errors:
+        gctx = inliner.inline(gctx)
 
     if errors:
         for node, msg in errors:
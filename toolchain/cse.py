@@ -0,0 +1,201 @@
+# coding: utf-8
+"""
+Common subexpression elimination. Function applications occurring more
+than once in a definition body are evaluated once and bound with let
+expression, the UEBB coder keeps the value in a stack slot and pushes
+a copy of it for every occurrence:
+
+    eliminator = cse.Eliminator(gctx)
+    gctx = eliminator.eliminate()
+
+Evaluation may not terminate or may divide by zero, so an application is
+bound only where it is certain to be evaluated: at the body, a branch
+of conditional or the body of let expression which evaluates one of the
+occurrences outside branches of inner conditionals. Applications which
+are cheaper to evaluate again than to keep in the stack are left as
+they are. Bound names start with a quote, so they can not collide with
+variables of the source or names made by the inliner.
+"""
+
+import sys
+import absy
+import astcache
+import callgraph
+from inliner import rebuild
+
+CALL_COST = 4 # PushAddr, Call, Slide and Ret in addition to the parameters
+
+def rewrite(node, replace):
+    """
+    Copy of expression where nodes for which replace returns a node are
+    replaced by it, nodes occurring more than once are copied every time
+    """
+    values = []
+    stack = [(node, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            count = len(node.children())
+            children = values[-count:]
+            del values[-count:]
+            values.append(rebuild(node, children))
+            continue
+        replacement = replace(node)
+        if replacement is not None:
+            values.append(replacement)
+        elif node.children():
+            stack.append((node, True))
+            stack.extend([(child, False) for child in reversed(node.children())])
+        else:
+            values.append(node)
+    return values[0]
+
+class Eliminator(object):
+    def __init__(self, gctx):
+        self.gctx = gctx
+        self.counter = 0 # Number of names made
+        self.eliminated = {} # Function name to number of applications bound
+
+    def eliminate(self, root="MAIN"):
+        """
+        Return global context where common subexpressions are bound in
+        functions reachable from root
+        """
+        graph = callgraph.CallGraph(self.gctx, root)
+        result = dict(self.gctx)
+        for name, d in self.gctx.iteritems():
+            if name in graph.reachable:
+                body = self.definition(d)
+                if body is not d.body:
+                    result[name] = absy.Definition(d.name, d.args, d.return_type, body, d.token)
+        return result
+
+    @property
+    def removed(self):
+        return sum(self.eliminated.itervalues())
+
+    def definition(self, d):
+        body = d.body
+        scope = frozenset([arg_name for arg_name, arg_type in d.args])
+        while True:
+            candidate = self.candidate(body, scope)
+            if candidate is None:
+                return body
+            region, expr, key = candidate
+            self.counter += 1
+            name = "'cse%d" % self.counter
+            self.eliminated[d.name] = self.eliminated.get(d.name, 0) + 1
+            body = self.bind(body, region, expr, key, name)
+
+    def keys(self, body):
+        """
+        Return dictionary of node id to number which is the same for equal
+        expressions, estimated cost and free variables of each number
+        """
+        interned = {}
+        key = {}
+        cost = []
+        free = []
+        stack = [(body, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if id(node) in key:
+                continue
+            children = node.children()
+            if not expanded and children:
+                stack.append((node, True))
+                stack.extend([(child, False) for child in children])
+                continue
+            children = [key[id(child)] for child in children]
+            if isinstance(node, absy.Variable):
+                structure = "var", node.name
+                variables = frozenset([node.name])
+            elif isinstance(node, absy.Value):
+                structure = "value", node.type, node.value
+                variables = frozenset()
+            elif isinstance(node, absy.Let):
+                structure = "let", node.name, children[0], children[1]
+                variables = free[children[0]] | (free[children[1]] - frozenset([node.name]))
+            else:
+                structure = (node.__class__.__name__, getattr(node, "func_name", None)) + tuple(children)
+                variables = frozenset().union(*[free[child] for child in children])
+            if structure not in interned:
+                interned[structure] = len(cost)
+                call = isinstance(node, absy.Apply) and not isinstance(self.gctx[node.func_name], absy.DefinitionBuiltin)
+                cost.append(1 + sum([cost[child] for child in children]) + (CALL_COST if call else 0))
+                free.append(variables)
+            key[id(node)] = interned[structure]
+        return key, cost, free
+
+    def candidate(self, body, scope):
+        """
+        Return region, application and its key number to bind there, or
+        None if there is nothing worth binding. Outer regions come first
+        """
+        key, cost, free = self.keys(body)
+        regions = [(body, scope)]
+        counts = [{}] # Region number to key number to occurrences in it
+        strict = [set()] # Region number to key numbers certainly evaluated in it
+        stack = [(body, [0], [0])]
+        while stack:
+            node, strict_in, enclosing = stack.pop()
+            if isinstance(node, absy.Apply):
+                k = key[id(node)]
+                for r in enclosing:
+                    counts[r][k] = counts[r].get(k, 0) + 1
+                for r in strict_in:
+                    strict[r].add(k)
+            if isinstance(node, absy.Conditional) or isinstance(node, absy.Let):
+                stack.append((node.children()[0], strict_in, enclosing))
+                inner = regions[enclosing[-1]][1]
+                if isinstance(node, absy.Let):
+                    inner = inner | frozenset([node.name])
+                for child in node.children()[1:]:
+                    regions.append((child, inner))
+                    counts.append({})
+                    strict.append(set())
+                    r = len(regions) - 1
+                    # Body of let is evaluated whenever the let is, branches are not
+                    stack.append((child, strict_in + [r] if isinstance(node, absy.Let) else [r], enclosing + [r]))
+            else:
+                stack.extend([(child, strict_in, enclosing) for child in node.children()])
+
+        for r, (region, scope) in enumerate(regions):
+            best = None
+            for k in sorted(strict[r]):
+                n = counts[r][k]
+                if n >= 2 and free[k] <= scope and (n - 1) * cost[k] > n + 1 and (best is None or cost[k] > cost[best]):
+                    best = k
+            if best is not None:
+                for node in absy.walk(region):
+                    if key.get(id(node)) == best:
+                        return region, node, best
+        return None
+
+    def bind(self, body, region, expr, k, name):
+        """
+        Return body where region evaluates expr once and binds it to name
+        """
+        key, cost, free = self.keys(body)
+        variable = absy.Variable(name, None)
+        variable.type = expr.type
+        bound = absy.Let(name, expr, rewrite(region, lambda node: variable if key.get(id(node)) == k else None), region.token)
+        bound.type = region.type
+        return rewrite(body, lambda node: bound if node is region else None)
+
+def eliminate(gctx, root="MAIN"):
+    return Eliminator(gctx).eliminate(root)
+
+if __name__ == "__main__":
+    import inliner
+    filename = sys.argv[1]
+    gctx, errors = astcache.front_end(filename)
+    if errors:
+        for node, msg in errors:
+            print msg, "on line", node.line, "column", node.column
+    else:
+        eliminator = Eliminator(inliner.inline(gctx))
+        for d in callgraph.prune(eliminator.eliminate()).itervalues():
+            if not isinstance(d, absy.DefinitionBuiltin):
+                print d
+        print eliminator.removed, "common subexpressions eliminated"
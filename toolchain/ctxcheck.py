@@ -1,40 +1,79 @@
 
 import builtin
 import absy
-import parser
 
-class ContextCheckError(parser.ParseError):
-    pass
+def annotate(d, gctx, visited=None):
+    """
+    Infer types of definition body in a single pass and store them in the
+    type attribute of the nodes, yield errors found on the way.
+    Children are typed before their parents without recursion. Nodes in
+    visited are skipped, which lets hash-consed nodes be checked only once.
+    """
+    if visited is None:
+        visited = set()
+    lctx = dict(d.args)
+    stack = [(d.body, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if id(node) in visited:
+            continue
+        children = node.children()
+        if not expanded and children:
+            stack.append((node, True))
+            stack.extend([(child, False) for child in children])
+            continue
+        visited.add(id(node))
 
-def infer_type(expr, gctx, lctx):
-    if isinstance(expr, absy.Boolean):
-        return "bool"
-    elif isinstance(expr, absy.Nat):
-        return "nat"
-    elif isinstance(expr, absy.Conditional):
-        type_then = infer_type(expr.expr_then, gctx, lctx)
-        type_else = infer_type(expr.expr_else, gctx, lctx)
-        if type_then == type_else:
-            return type_then
-        else:
-            raise ContextCheckError("Then returns %s, but else returns %s" % (type_then, type_else), expr.token)
-    elif isinstance(expr, absy.Apply):
-        d = gctx[expr.token.lexeme]
-        assert len(expr.parameters) == len(d.args), "Function requires %d functions, got %d" % (len(d.args), len(expr.parameters))
-        for i, (arg_name, arg_type) in enumerate(d.args):
-            inferred_type = infer_type(expr.parameters[i], gctx, lctx)
-            if inferred_type == arg_type:
-                return d.return_type
-            else:
-                raise ContextCheckError("Function %s expected %s for argument %d, got %s" % (d.name, arg_type, i+1, inferred_type), expr.token)
+        if isinstance(node, absy.Variable):
+            node.type = lctx.get(node.name)
+            if node.type is None:
+                yield node.token, "Variable %s not defined in local context" % node.name
+
+        elif isinstance(node, absy.Apply):
+            f = gctx.get(node.func_name)
+            if f is None:
+                node.type = None
+                yield node.token, "Could not resolve function named %s" % node.func_name
+                continue
+            node.type = f.return_type
+            if len(node.parameters) != len(f.args):
+                yield node.token, "Function %s requires %d arguments, got %d" % (f.name, len(f.args), len(node.parameters))
+                continue
+            for i, (param, (arg_name, arg_type)) in enumerate(zip(node.parameters, f.args)):
+                if param.type is not None and param.type != arg_type:
+                    yield node.token, "Function %s expected %s for argument %d, got %s" % (f.name, arg_type, i+1, param.type)
+
+        elif isinstance(node, absy.Conditional):
+            token = node.token or d.token
+            if node.expr_if.type not in (None, "bool"):
+                yield token, "Condition evaluates to %s, was expecting bool" % node.expr_if.type
+            node.type = node.expr_then.type
+            if node.expr_else is not None and node.expr_else.type != node.type:
+                if node.type is not None and node.expr_else.type is not None:
+                    yield token, "Then returns %s, but else returns %s" % (node.type, node.expr_else.type)
+                node.type = None
 
-    elif isinstance(expr, absy.Variable):
-        return lctx[expr.name]
-    raise ContextCheckError("Don't know how to infer type for %s" % expr, expr.token)
-    
+    # Check that definition body expression evaluates to something of definition return type
+    if d.body.type is not None and d.body.type != d.return_type:
+        yield d.token, "Expression evaluated to %s, function return type was defined as %s" % (d.body.type, d.return_type)
 
-def context_check(defs):
-    gctx = {
+def check_definition(d, gctx, visited=None):
+    """
+    Check single definition against functions defined in global context
+    """
+    arg_names = set()
+    for arg_name, arg_type in d.args:
+        if arg_name in arg_names:
+            yield d.token, "Multiple arguments with same name: %s" % arg_name
+        arg_names.add(arg_name)
+    for t, msg in annotate(d, gctx, visited):
+        yield t, msg
+
+def global_context():
+    """
+    Global context with built-in functions only
+    """
+    return {
         "eq":  builtin.DefinitionEq(),
         "sub": builtin.DefinitionSub(),
         "add": builtin.DefinitionAdd(),
@@ -43,6 +82,13 @@ def context_check(defs):
         "lt":  builtin.DefinitionLessThan()
     }
 
+def context_check(defs, check=check_definition):
+    """
+    Set up global context and check definitions,
+    check can be substituted to reuse results of previous checks
+    """
+    gctx = global_context()
+
     def aggregate():
         errors = []
         for d in defs:
@@ -51,14 +97,11 @@ def context_check(defs):
             else:
                 gctx[d.name] = d
                 
+        visited = set()
         for d in defs:
-            for t, msg in d.check(gctx):
+            for t, msg in check(d, gctx, visited):
                 yield t, msg
-        inferred_type = infer_type(d.body, gctx, dict(d.args))
-        if inferred_type != d.return_type:
-            raise ContextCheckError("Expression evaluated to %s, function return type was defined as %s" % (inferred_type, d.return_type), d.token)
-            
-        # Check that definition body expression evaluates to something of definition return type
+
         if "MAIN" not in gctx:
             yield d.token, "No MAIN defined"
     return gctx, tuple(aggregate())
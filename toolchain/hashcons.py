@@ -0,0 +1,79 @@
+# coding: utf-8
+"""
+Hash-consing of syntax trees, structurally identical subexpressions
+are interned so that each of them is stored only once.
+Pass an Interner to the parser to construct hash-consed trees:
+
+    defs, state = CursorParser(tokens, hashcons.Interner()).parse()
+
+Interned nodes are shared between definitions and must not be modified.
+"""
+
+import absy
+
+class Interner(object):
+    """
+    Node factory for the parser, expressions are interned as soon as
+    the definition containing them is complete. Variables are keyed by
+    their declared type so that a shared node means the same thing in
+    every definition. Tokens of the first occurrence are kept.
+    """
+    Apply = absy.Apply
+    Variable = absy.Variable
+    Nat = absy.Nat
+    Boolean = absy.Boolean
+    Conditional = absy.Conditional
+
+    def __init__(self):
+        self.table = {}
+        self.nodes = 0 # Number of expression nodes seen
+
+    def Definition(self, name, args, return_type, body, token):
+        return absy.Definition(name, args, return_type, self.intern(body, dict(args)), token)
+
+    def intern(self, node, lctx):
+        """
+        Return interned copy of the expression, children are interned
+        before their parents without recursion
+        """
+        root = node
+        interned = {}
+        stack = [(node, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if id(node) in interned:
+                continue
+            children = node.children()
+            if not expanded and children:
+                stack.append((node, True))
+                stack.extend([(child, False) for child in children])
+                continue
+            children = tuple([interned[id(child)] for child in children])
+            key = self.key(node, children, lctx)
+            if key not in self.table:
+                if isinstance(node, absy.Apply) and children != node.parameters:
+                    self.table[key] = absy.Apply(node.func_name, children, node.token)
+                    self.table[key].type = node.type
+                elif isinstance(node, absy.Conditional) and children != node.children():
+                    self.table[key] = absy.Conditional(*children, token=node.token)
+                    self.table[key].type = node.type
+                else:
+                    self.table[key] = node
+            interned[id(node)] = self.table[key]
+            self.nodes += 1
+        return interned[id(root)]
+
+    def key(self, node, children, lctx):
+        if isinstance(node, absy.Variable):
+            return absy.Variable, node.name, lctx.get(node.name)
+        if isinstance(node, absy.Value):
+            return node.__class__, node.value
+        if isinstance(node, absy.Apply):
+            return (absy.Apply, node.func_name) + tuple([id(child) for child in children])
+        return (node.__class__,) + tuple([id(child) for child in children])
+
+    def __len__(self):
+        """
+        Number of unique expression nodes
+        """
+        return len(self.table)
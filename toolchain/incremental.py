@@ -0,0 +1,141 @@
+# coding: utf-8
+"""
+Incremental front end, the source is split into definitions which are
+keyed by hash of their text. Parse and check results of unchanged
+definitions are reused, only changed definitions and the ones calling
+them are parsed and checked again.
+"""
+
+import os
+import sys
+import hashlib
+import cPickle as pickle
+import absy
+import astcache
+import lexer
+import parparse
+from parser import CursorParser
+from ctxcheck import context_check, check_definition
+
+class Entry(object):
+    """
+    Definitions parsed from a piece of source and their check results
+    """
+    def __init__(self, defs, line):
+        self.defs = defs
+        self.line = line
+        self.calls = set()
+        for d in defs:
+            self.calls.update([node.func_name for node in absy.walk(d) if isinstance(node, absy.Apply)])
+        self.errors = None
+
+    def relocate(self, line):
+        """
+        Shift line numbers of tokens if the piece has moved in the source
+        """
+        delta = line - self.line
+        if delta:
+            for d in self.defs:
+                for node in absy.walk(d):
+                    token = getattr(node, "token", None)
+                    if token is not None:
+                        token.line += delta
+            self.line = line
+
+class Frontend(object):
+    """
+    Incremental front end, entries are kept in memory between calls of
+    check and optionally in a cache file between runs
+    """
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.entries = {}
+        self.digests = {} # Function name to digest of the piece it was defined in
+        self.parsed = self.checked = 0
+        if filename and os.path.exists(filename):
+            self.load()
+
+    def load(self):
+        """
+        Load entries from the cache file unless it was written by another
+        toolchain, version is unpickled first as stale entries may not be
+        """
+        with open(self.filename, "rb") as fh:
+            try:
+                if pickle.load(fh) == astcache.VERSION:
+                    self.entries, self.digests = pickle.load(fh)
+            except (EOFError, ValueError, TypeError, AttributeError, ImportError, pickle.UnpicklingError):
+                pass
+
+    def save(self):
+        with open(self.filename, "wb") as fh:
+            pickle.dump(astcache.VERSION, fh, pickle.HIGHEST_PROTOCOL)
+            pickle.dump((self.entries, self.digests), fh, pickle.HIGHEST_PROTOCOL)
+
+    def check(self, source):
+        """
+        Parse and check source, return global context and errors like context_check
+        """
+        self.parsed = self.checked = 0
+        entries = {}
+        pieces = []
+        # Splitting into as many pieces as there are characters yields one piece per definition
+        for start, end, line, column in parparse.split(source, len(source) or 1):
+            text = source[start:end]
+            digest = hashlib.sha1("%d:%s" % (column, text)).hexdigest()
+            entry = self.entries.get(digest)
+            if entry is None or digest in entries:
+                # Identical pieces are parsed separately, as tokens are relocated in place
+                defs, state = CursorParser(tuple(lexer.tokenize_source(text, line, column))).parse()
+                entry = Entry(defs, line)
+                self.parsed += len(defs)
+            else:
+                entry.relocate(line)
+            entries.setdefault(digest, entry)
+            pieces.append((digest, entry))
+
+        # Functions which were added, removed or modified since previous check
+        digests = {}
+        for digest, entry in pieces:
+            for d in entry.defs:
+                digests[d.name] = digest
+        changed = set([name for name, digest in digests.items() if self.digests.get(name) != digest])
+        changed.update([name for name in self.digests if name not in digests])
+
+        for digest, entry in pieces:
+            if entry.errors is None or entry.calls & changed:
+                entry.errors = [None] * len(entry.defs)
+        origin = {}
+        for digest, entry in pieces:
+            for index, d in enumerate(entry.defs):
+                origin[id(d)] = entry, index
+
+        def check(d, gctx, visited):
+            entry, index = origin[id(d)]
+            if entry.errors[index] is None:
+                entry.errors[index] = tuple(check_definition(d, gctx, visited))
+                self.checked += 1
+            return entry.errors[index]
+
+        gctx, errors = context_check([d for digest, entry in pieces for d in entry.defs], check)
+        self.entries = entries
+        self.digests = digests
+        return gctx, errors
+
+def context_check_file(filename):
+    """
+    Check source file, parse and check results are cached next to the source file
+    """
+    frontend = Frontend(filename[:-3] + ".inc")
+    result = frontend.check(open(filename).read())
+    frontend.save()
+    return result
+
+if __name__ == "__main__":
+    filename, = sys.argv[1:]
+    frontend = Frontend(filename[:-3] + ".inc")
+    gctx, errors = frontend.check(open(filename).read())
+    frontend.save()
+    for node, msg in errors:
+        print msg, "on line", node.line, "column", node.column
+    print "Parsed %d and checked %d definitions" % (frontend.parsed, frontend.checked)
@@ -0,0 +1,197 @@
+# coding: utf-8
+"""
+Inlining of small non-recursive functions. Calls of such functions are
+replaced by their bodies with parameters substituted for the arguments:
+
+    inlined = inliner.Inliner(gctx)
+    gctx = inlined.inline()
+    print inlined.report()
+
+Parameters which are variables or literals, or which are used exactly
+once and not in a branch of conditional, are substituted as they are.
+Others are bound with let expressions so that they are evaluated once,
+before the body as they were before the call. Names bound by let are
+made unique with a suffix such as x'3, the quote can not appear in
+µ-Opal source so they can not capture variables of the caller.
+"""
+
+import sys
+import absy
+import astcache
+import callgraph
+
+DEFAULT_SIZE = 20 # Maximum number of nodes in inlined body
+
+def size(node):
+    return sum(1 for n in absy.walk(node))
+
+def rebuild(node, children):
+    """
+    Node with given children, node itself if they did not change
+    """
+    if all([a is b for a, b in zip(children, node.children())]):
+        return node
+    if isinstance(node, absy.Apply):
+        rebuilt = absy.Apply(node.func_name, tuple(children), node.token)
+    elif isinstance(node, absy.Conditional):
+        rebuilt = absy.Conditional(*children, token=node.token)
+    elif isinstance(node, absy.Let):
+        rebuilt = absy.Let(node.name, children[0], children[1], node.token)
+    else:
+        raise Exception("Don't know how to rebuild: %s of class %s" % (node, node.__class__.__name__))
+    rebuilt.type = node.type
+    return rebuilt
+
+def occurrences(node):
+    """
+    Return dictionary of variable name to number of its occurrences
+    and whether any of them is in a branch of conditional
+    """
+    result = {}
+    stack = [(node, False)]
+    while stack:
+        node, guarded = stack.pop()
+        if isinstance(node, absy.Variable):
+            count, was_guarded = result.get(node.name, (0, False))
+            result[node.name] = count + 1, was_guarded or guarded
+        elif isinstance(node, absy.Conditional):
+            stack.append((node.expr_if, guarded))
+            stack.extend([(child, True) for child in node.children()[1:]])
+        else:
+            stack.extend([(child, guarded) for child in node.children()])
+    return result
+
+class Inliner(object):
+    def __init__(self, gctx, max_size=DEFAULT_SIZE):
+        self.gctx = gctx
+        self.max_size = max_size
+        self.bodies = {} # Function name to body with calls inlined
+        self.inlinable = set()
+        self.inlined = {} # Function name to number of its calls removed
+        self.counter = 0 # Number of names made unique
+
+    def inline(self, root="MAIN"):
+        """
+        Return global context where calls are inlined in functions
+        reachable from root
+        """
+        graph = callgraph.CallGraph(self.gctx, root)
+        result = dict(self.gctx)
+        # Callees come first, so their bodies have calls inlined already
+        for component in graph.components:
+            for name in component:
+                if name not in graph.reachable:
+                    continue
+                d = self.gctx[name]
+                self.bodies[name] = self.expression(d.body)
+                if name != root and not graph.is_recursive(name) and size(self.bodies[name]) <= self.max_size:
+                    self.inlinable.add(name)
+                result[name] = absy.Definition(d.name, d.args, d.return_type, self.bodies[name], d.token)
+        return result
+
+    @property
+    def removed(self):
+        return sum(self.inlined.itervalues())
+
+    def report(self):
+        return "\n".join(["%-20s %6d calls inlined" % item for item in sorted(self.inlined.iteritems())])
+
+    def fresh(self, name):
+        self.counter += 1
+        return "%s'%d" % (name.split("'")[0], self.counter)
+
+    def expression(self, node):
+        """
+        Return expression with calls of inlinable functions inlined
+        """
+        root = node
+        inlined = {}
+        stack = [(node, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if id(node) in inlined:
+                continue
+            children = node.children()
+            if not expanded and children:
+                stack.append((node, True))
+                stack.extend([(child, False) for child in children])
+                continue
+            children = [inlined[id(child)] for child in children]
+            if isinstance(node, absy.Apply) and node.func_name in self.inlinable:
+                inlined[id(node)] = self.expand(self.gctx[node.func_name], children)
+            elif children:
+                inlined[id(node)] = rebuild(node, children)
+            else:
+                inlined[id(node)] = node
+        return inlined[id(root)]
+
+    def expand(self, d, parameters):
+        """
+        Body of d for call with parameters
+        """
+        body = self.bodies[d.name]
+        uses = occurrences(body)
+        env = {}
+        bindings = []
+        for (arg_name, arg_type), param in zip(d.args, parameters):
+            count, guarded = uses.get(arg_name, (0, False))
+            if isinstance(param, absy.Variable) or isinstance(param, absy.Value) or (count == 1 and not guarded):
+                env[arg_name] = param
+            else:
+                name = self.fresh(arg_name)
+                env[arg_name] = absy.Variable(name, None)
+                bindings.append((name, param))
+        # Names bound in the body are made unique again for this copy of it
+        for node in absy.walk(body):
+            if isinstance(node, absy.Let):
+                env[node.name] = absy.Variable(self.fresh(node.name), None)
+        expanded = self.substitute(body, env)
+        for name, param in reversed(bindings):
+            expanded = absy.Let(name, param, expanded)
+            expanded.type = body.type
+        self.inlined[d.name] = self.inlined.get(d.name, 0) + 1
+        return expanded
+
+    def substitute(self, node, env):
+        """
+        Copy of expression where variables are replaced by expressions in env
+        """
+        root = node
+        substituted = {}
+        stack = [(node, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if id(node) in substituted:
+                continue
+            children = node.children()
+            if not expanded and children:
+                stack.append((node, True))
+                stack.extend([(child, False) for child in children])
+                continue
+            children = [substituted[id(child)] for child in children]
+            if isinstance(node, absy.Variable):
+                substituted[id(node)] = env[node.name]
+            elif isinstance(node, absy.Let):
+                substituted[id(node)] = absy.Let(env[node.name].name, children[0], children[1], node.token)
+                substituted[id(node)].type = node.type
+            elif children:
+                substituted[id(node)] = rebuild(node, children)
+            else:
+                substituted[id(node)] = node
+        return substituted[id(root)]
+
+def inline(gctx, max_size=DEFAULT_SIZE, root="MAIN"):
+    return Inliner(gctx, max_size).inline(root)
+
+if __name__ == "__main__":
+    filename = sys.argv[1]
+    gctx, errors = astcache.front_end(filename)
+    if errors:
+        for node, msg in errors:
+            print msg, "on line", node.line, "column", node.column
+    else:
+        inlined = Inliner(gctx)
+        for d in callgraph.prune(inlined.inline()).itervalues():
+            if not isinstance(d, absy.DefinitionBuiltin):
+                print d
+        print inlined.report()
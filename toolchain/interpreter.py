@@ -5,20 +5,37 @@ syntax tree.
 """
 
 import sys
-import lexer
-from parser import Parser
-from ctxcheck import context_check
+import astcache
+import callgraph
+import inliner
+import memo
+import partial
 
-def interpret(filename):
-    tokens = tuple(lexer.tokenize(filename))
-    defs, state = Parser(*tokens).parse()
-    gctx, errors = context_check(defs)
+def interpret(filename, memoize=None, profile=None, fuel=None, inline=False):
+    """
+    Evaluate MAIN of the source file, functions named in memoize are
+    memoized, memoize=True memoizes all of them and caches made by
+    memo.caches are used as they are. Calls are recorded by
+    profile if it is given. Program is partially evaluated first if
+    fuel is given and small functions are inlined if inline is set
+    """
+    gctx, errors = astcache.front_end(filename)
 
     if errors:
         for node, msg in errors:
             print msg, "on line", node.line, "column", node.column
 
     else:
+        if fuel is not None:
+            gctx = partial.reduce(gctx, fuel)
+        if inline:
+            gctx = inliner.inline(gctx)
+        gctx = callgraph.prune(gctx)
+        caches = memo.select(gctx, memoize)
+        if caches:
+            gctx = memo.memoize(gctx, caches)
+        if profile is not None:
+            gctx = profile.instrument(gctx, caches)
         return gctx["MAIN"].evaluate({}, gctx)
 
 if __name__ == "__main__":
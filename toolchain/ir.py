@@ -41,6 +41,17 @@ class Push(Instruction):
 
     def __repr__(self):
         return "%s(%s)" % (self.mnemonic, self.name)
+
+class Store(Instruction):
+    """
+    Pop value from top of the stack and overwrite the item offset
+    places below the new top with it, Push(offset) would read it back
+    """
+    def __init__(self, offset):
+        self.offset = offset
+
+    def __repr__(self):
+        return "%s(%d)" % (self.mnemonic, self.offset)
        
 class PushAddr(Instruction):
     def __init__(self, target):
@@ -81,6 +92,17 @@ class Jump(Instruction):
     
 class ConditionalJump(Jump):
     mnemonic = "Jz"
+
+"""
+Compare and branch instructions pop two items, the one pushed first is
+the left operand, and jump if comparison holds
+"""
+
+class JumpEqual(ConditionalJump):
+    mnemonic = "Jeq"
+
+class JumpLessThan(ConditionalJump):
+    mnemonic = "Jlt"
     
 class Swap(Instruction):
     pass
@@ -0,0 +1,175 @@
+# coding: utf-8
+"""
+Call-by-need evaluation on top of the closure compiling interpreter.
+Arguments a function is not certain to use are passed as thunks, which
+are evaluated the first time they are used and remember their value.
+Arguments a function always uses are strict and evaluated before the
+call as usual, this avoids creating thunks for most arguments:
+
+    functions = compile_program(gctx)
+    functions["MAIN"](())
+
+Strictness assumes that evaluation terminates, for recursive functions
+the greatest fixpoint is taken: every argument is considered strict
+until the body shows otherwise.
+"""
+
+import sys
+from operator import itemgetter
+import absy
+import astcache
+import callgraph
+import closures
+
+class Thunk(object):
+    __slots__ = "code", "env", "value"
+
+    def __init__(self, code, env):
+        self.code = code
+        self.env = env
+
+    def force(self):
+        if self.code is not None:
+            self.value = self.code(self.env)
+            self.code = self.env = None # Release the environment
+        return self.value
+
+def strict_variables(d, gctx, strictness):
+    """
+    Names of variables that are always evaluated when the body of d is
+    """
+    strict = {}
+    stack = [(d.body, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if id(node) in strict:
+            continue
+        children = node.children()
+        if not expanded and children:
+            stack.append((node, True))
+            stack.extend([(child, False) for child in children])
+            continue
+
+        if isinstance(node, absy.Variable):
+            strict[id(node)] = frozenset([node.name])
+        elif isinstance(node, absy.Conditional):
+            strict[id(node)] = strict[id(node.expr_if)]
+            if node.expr_else is not None:
+                strict[id(node)] = strict[id(node)] | (strict[id(node.expr_then)] & strict[id(node.expr_else)])
+        elif isinstance(node, absy.Apply):
+            f = gctx[node.func_name]
+            if isinstance(f, absy.DefinitionBuiltin):
+                flags = (True,) * len(node.parameters)
+            else:
+                flags = strictness[f.name]
+            strict[id(node)] = frozenset().union(*[strict[id(child)] for child, flag in zip(node.parameters, flags) if flag])
+        else:
+            strict[id(node)] = frozenset()
+    return strict[id(d.body)]
+
+def strictness(gctx, root="MAIN"):
+    """
+    Return dictionary of function name to tuple of flags telling which of
+    its arguments are strict, functions reachable from root are analysed
+    """
+    graph = callgraph.CallGraph(gctx, root)
+    result = {}
+    for component in graph.components:
+        if component[0] not in graph.reachable:
+            continue
+        for name in component:
+            result[name] = (True,) * len(gctx[name].args)
+        changed = True
+        while changed:
+            changed = False
+            for name in component:
+                d = gctx[name]
+                strict = strict_variables(d, gctx, result)
+                flags = tuple([arg_name in strict for arg_name, arg_type in d.args])
+                if flags != result[name]:
+                    result[name] = flags
+                    changed = True
+    return result
+
+def lazy_variable(index):
+    def variable(env):
+        value = env[index]
+        if type(value) is Thunk:
+            return value.force()
+        return value
+    return variable
+
+def delay(code):
+    return lambda env: Thunk(code, env)
+
+def compile_definition(d, gctx, cells, strictness):
+    """
+    Return closure evaluating body of definition d, environment holds
+    values of strict arguments and thunks or values of the others
+    """
+    strict = strictness[d.name]
+    slots = dict([(arg_name, index) for index, (arg_name, arg_type) in enumerate(d.args)])
+    compiled = {}
+    stack = [(d.body, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if id(node) in compiled:
+            continue
+        children = node.children()
+        if not expanded and children:
+            stack.append((node, True))
+            stack.extend([(child, False) for child in children])
+            continue
+        compiled_children = [compiled[id(child)] for child in children]
+
+        if isinstance(node, absy.Variable):
+            index = slots[node.name]
+            compiled[id(node)] = itemgetter(index) if strict[index] else lazy_variable(index)
+        elif isinstance(node, absy.Value):
+            compiled[id(node)] = closures.constant(node.value)
+        elif isinstance(node, absy.Apply):
+            f = gctx[node.func_name]
+            if isinstance(f, absy.DefinitionBuiltin):
+                compiled[id(node)] = closures.BUILTIN_MAPPING[f.__class__](*compiled_children)
+                continue
+            parameters = []
+            for child, code, flag in zip(children, compiled_children, strictness[f.name]):
+                if flag or isinstance(child, absy.Value):
+                    parameters.append(code)
+                elif isinstance(child, absy.Variable):
+                    parameters.append(itemgetter(slots[child.name])) # Pass thunk or value on as it is
+                else:
+                    parameters.append(delay(code))
+            compiled[id(node)] = closures.call(cells[node.func_name], parameters)
+        elif isinstance(node, absy.Conditional):
+            if len(compiled_children) < 3:
+                raise Exception("Conditional without ELSE can not be compiled")
+            compiled[id(node)] = closures.conditional(*compiled_children)
+        else:
+            raise Exception("Don't know how to compile: %s of class %s" % (node, node.__class__.__name__))
+    return compiled[id(d.body)]
+
+def compile_program(gctx, root="MAIN"):
+    """
+    Compile definitions reachable from root, return dictionary of function
+    name to compiled function. Functions take tuple of argument values
+    """
+    flags = strictness(gctx, root)
+    cells = dict([(name, [None]) for name in flags])
+    for name in flags:
+        cells[name][0] = compile_definition(gctx[name], gctx, cells, flags)
+    return dict([(name, cell[0]) for name, cell in cells.iteritems()])
+
+def interpret(filename):
+    gctx, errors = astcache.front_end(filename)
+
+    if errors:
+        for node, msg in errors:
+            print msg, "on line", node.line, "column", node.column
+
+    else:
+        return compile_program(gctx)["MAIN"](())
+
+if __name__ == "__main__":
+    filename, = sys.argv[1:]
+    print "The MAIN function returned:", interpret(filename)
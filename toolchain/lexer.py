@@ -108,38 +108,150 @@ TOKENS = \
     
 import sys
 import re
+from array import array
 
+# All token classes are merged into one alternation, the alternatives are
+# tried in TOKENS order so keywords still win over identifiers
+MASTER_REGEX = re.compile("|".join(["(?P<%s>%s)" % (token_class.__name__, token_class.REGEX) for token_class in TOKENS]))
+# Group name to class of tokens passed on to the parser, others are skipped
+MEANINGFUL_CLASSES = dict([(token_class.__name__, token_class) for token_class in TOKENS if not issubclass(token_class, TokenMeaningless)])
 
-def tokenize(filename):
+def scan(chunks, line=1, column=1):
     """
-    Tokenize source code
+    Scan source code arriving as an iterable of string chunks, generate
+    class, lexeme, offset from the beginning of the source, line and
+    column of meaningful tokens followed by end of file. Tokens and
+    comments may cross chunk boundaries, only the unconsumed tail of the
+    current chunk is kept in memory.
     """
-    remainder = open(filename).read()
-    line = 1
-    column = 1
-    while remainder:
-        for token_class in TOKENS:
-            m = re.match(token_class.REGEX, remainder)
-            if not m:
-                continue
-            lexeme = remainder[:m.end()]
-            token = token_class(lexeme, line, column)
-
-            if not isinstance(token, TokenMeaningless):
-                yield token
-
-            if "\n" in lexeme:
-                line += lexeme.count("\n")
-                column = len(lexeme.rsplit("\n", 1)[1])
+    chunks = iter(chunks)
+    match = MASTER_REGEX.match
+    buf = ""
+    position = 0
+    consumed = 0 # Characters dropped from the beginning of the buffer
+    eof = False
+    while True:
+        m = match(buf, position)
+        if not eof and (not m or m.end() == len(buf)):
+            # Token might continue in the next chunk, drop the consumed part of the buffer and read more
+            chunk = next(chunks, None)
+            if chunk is None:
+                eof = True
             else:
-                column += len(lexeme)
-            remainder = remainder[m.end():]
+                consumed += position
+                buf = buf[position:] + chunk
+                position = 0
+            continue
+        if not m:
+            if position < len(buf):
+                raise RuntimeError("Could not parse: %s" % buf[position:])
             break
+        token_class = MEANINGFUL_CLASSES.get(m.lastgroup)
+        lexeme = m.group()
+
+        if token_class is not None:
+            yield token_class, lexeme, consumed + position, line, column
+
+        if "\n" in lexeme:
+            line += lexeme.count("\n")
+            column = len(lexeme) - lexeme.rfind("\n") - 1
         else:
-            raise RuntimeError("Could not parse: %s" % remainder)
-            
-    # Appending EOF makes it easier to parse, as head is always present for parse(head, *tokens)
-    yield TokenEndOfFile("", line, column)
+            column += len(lexeme)
+        position = m.end()
+
+    yield TokenEndOfFile, "", consumed + position, line, column
+
+def tokenize_chunks(chunks, line=1, column=1):
+    """
+    Tokenize source code arriving as an iterable of string chunks.
+    Line and column of the first character can be given
+    if the source is a piece of a bigger file.
+    """
+    # EOF at the end makes it easier to parse, as head is always present for parse(head, *tokens)
+    for token_class, lexeme, offset, line, column in scan(chunks, line, column):
+        yield token_class(lexeme, line, column)
+
+def tokenize_source(source, line=1, column=1):
+    """
+    Tokenize source code string
+    """
+    return tokenize_chunks((source,), line, column)
+
+# Token classes of TokenStream are identified by index in KINDS
+KINDS = TOKENS + (TokenEndOfFile,)
+KIND_CODES = dict([(token_class.__name__, code) for code, token_class in enumerate(KINDS)])
+
+class TokenView(object):
+    """
+    Token of TokenStream, attributes are looked up from the stream on demand
+    """
+    __slots__ = "stream", "index"
+
+    def __init__(self, stream, index):
+        self.stream = stream
+        self.index = index
+
+    @property
+    def lexeme(self):
+        return self.stream.lexeme(self.index)
+
+    @property
+    def line(self):
+        return self.stream.lines[self.index]
+
+    @property
+    def column(self):
+        return self.stream.columns[self.index]
+
+    def __repr__(self):
+        if self.stream.kind(self.index) is TokenEndOfFile:
+            return "EOF"
+        return repr(self.lexeme)
+
+class TokenStream(object):
+    """
+    Compact token stream: kind codes, offsets, lines and columns of
+    meaningful tokens are stored in arrays and lexemes are sliced from
+    the source when they are needed
+    """
+    def __init__(self, source):
+        self.source = source
+        self.kinds = array("B")
+        self.starts = array("l")
+        self.ends = array("l")
+        self.lines = array("I")
+        self.columns = array("I")
+
+        for token_class, lexeme, offset, line, column in scan((source,)):
+            self.append(KIND_CODES[token_class.__name__], offset, offset + len(lexeme), line, column)
+
+    def append(self, kind, start, end, line, column):
+        self.kinds.append(kind)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.lines.append(line)
+        self.columns.append(column)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, index):
+        return TokenView(self, index)
+
+    def kind(self, index):
+        return KINDS[self.kinds[index]]
+
+    def lexeme(self, index):
+        return self.source[self.starts[index]:self.ends[index]]
+
+def tokenize(filename, chunk_size=65536):
+    """
+    Tokenize source file, the file is read in chunks so memory usage does
+    not depend on the size of the file
+    """
+    with open(filename) as fh:
+        for token in tokenize_chunks(iter(lambda: fh.read(chunk_size), "")):
+            yield token
 
 if __name__ == "__main__":
     filename, = sys.argv[1:]
@@ -0,0 +1,149 @@
+# coding: utf-8
+"""
+Memoization of µ-Opal functions. Definitions are pure, so the result of
+a call depends on its arguments only and can be remembered. Every
+memoized function gets a bounded cache that evicts the least recently
+used results:
+
+    caches = memo.caches(gctx, ["fib"])
+    closures.compile_program(gctx, memoize=caches)["MAIN"](())
+    print memo.report(caches)
+
+The tree walker in absy is memoized by substituting definitions:
+
+    memo.memoize(gctx, caches)["MAIN"].evaluate((), gctx)
+"""
+
+import sys
+from collections import OrderedDict
+import absy
+import astcache
+import callgraph
+
+DEFAULT_SIZE = 4096
+
+MISSING = object()
+
+class LRUCache(object):
+    """
+    Dictionary of at most size entries, least recently used entry is
+    evicted first
+    """
+    def __init__(self, size=DEFAULT_SIZE):
+        if size < 1:
+            raise ValueError("Cache size must be positive, got %d" % size)
+        self.size = size
+        self.table = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, default=MISSING):
+        value = self.table.pop(key, MISSING)
+        if value is MISSING:
+            self.misses += 1
+            return default
+        self.table[key] = value # Move to the end, as most recently used
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.table.pop(key, None)
+        self.table[key] = value
+        if len(self.table) > self.size:
+            self.table.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.table.clear()
+
+    def __len__(self):
+        return len(self.table)
+
+def memoized(function, cache):
+    """
+    Wrap compiled function taking argument tuple
+    """
+    def lookup(env):
+        value = cache.get(env, MISSING)
+        if value is MISSING:
+            value = function(env)
+            cache.put(env, value)
+        return value
+    return lookup
+
+class MemoizedDefinition(object):
+    """
+    Stand-in for definition in global context of the tree walker,
+    calls are evaluated by the original definition on cache miss
+    """
+    def __init__(self, definition, cache):
+        self.definition = definition
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.definition, name)
+
+    def evaluate(self, parameters, gctx={}):
+        key = tuple(parameters)
+        value = self.cache.get(key, MISSING)
+        if value is MISSING:
+            value = self.definition.evaluate(key, gctx)
+            self.cache.put(key, value)
+        return value
+
+def caches(gctx, names=None, size=DEFAULT_SIZE):
+    """
+    Create caches for functions named, all functions reachable from MAIN
+    are memoized if names are not given
+    """
+    if names is None:
+        names = callgraph.CallGraph(gctx).reachable
+    caches = {}
+    for name in names:
+        if name not in gctx or isinstance(gctx[name], absy.DefinitionBuiltin):
+            raise ValueError("No user defined function named %s to memoize" % name)
+        caches[name] = LRUCache(size)
+    return caches
+
+def select(gctx, memoize):
+    """
+    Caches for the memoize argument of interpreters: names of functions,
+    True for all of them or caches made by caches() which are used as
+    they are, so their statistics can be read afterwards
+    """
+    if isinstance(memoize, dict):
+        return memoize
+    if memoize:
+        return caches(gctx, None if memoize is True else memoize)
+    return {}
+
+def memoize(gctx, caches):
+    """
+    Return global context where functions with caches are memoized
+    """
+    gctx = dict(gctx)
+    for name, cache in caches.iteritems():
+        gctx[name] = MemoizedDefinition(gctx[name], cache)
+    return gctx
+
+def report(caches):
+    """
+    Return hit and miss statistics of caches as text
+    """
+    lines = ["%-20s %10s %10s %10s %10s %7s" % ("Function", "Hits", "Misses", "Evictions", "Size", "Ratio")]
+    for name, cache in sorted(caches.iteritems()):
+        lookups = cache.hits + cache.misses
+        lines.append("%-20s %10d %10d %10d %10d %6.1f%%" % (name, cache.hits, cache.misses, cache.evictions, len(cache),
+            100.0 * cache.hits / lookups if lookups else 0.0))
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    import closures
+    filename, names = sys.argv[1], sys.argv[2:]
+    gctx, errors = astcache.front_end(filename)
+    if errors:
+        for node, msg in errors:
+            print msg, "on line", node.line, "column", node.column
+    else:
+        function_caches = caches(gctx, names or None)
+        print "The MAIN function returned:", closures.compile_program(gctx, memoize=function_caches)["MAIN"](())
+        print report(function_caches)
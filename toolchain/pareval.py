@@ -0,0 +1,194 @@
+# coding: utf-8
+"""
+Parallel evaluation, arguments of a function application are independent
+of each other so expensive ones can be evaluated in worker processes.
+Cost of expressions is estimated statically from the call graph, calls
+to recursive functions are considered expensive and so are calls to
+functions whose bodies cost more than the threshold. If an application
+has at least two expensive arguments, all but one of them are sent to
+the pool and the parent evaluates the rest. Cheap expressions and
+expressions that have no such applications in them are evaluated inline
+with the closure interpreter, as is everything once tasks_per_process
+tasks have been sent for every process. The first tasks are the biggest
+as the parent splits from the top of the tree down.
+
+Workers are forked after the evaluator is set up, so they inherit the
+program and only receive node numbers and argument tuples.
+"""
+
+import sys
+from multiprocessing import Pool, cpu_count
+import absy
+import astcache
+import callgraph
+import closures
+
+DEFAULT_THRESHOLD = 10000
+
+RECURSIVE = float("inf") # Cost of calling recursive function
+
+# Evaluator the worker processes inherit
+program = None
+
+def evaluate_task(task):
+    key, env = task
+    return program.inline(key)(env)
+
+class ParallelEvaluator(object):
+    def __init__(self, gctx, threshold=DEFAULT_THRESHOLD, tasks_per_process=4):
+        self.gctx = gctx
+        self.threshold = threshold
+        self.tasks_per_process = tasks_per_process
+        self.max_tasks = 0
+        self.graph = callgraph.CallGraph(gctx)
+        self.functions = closures.compile_program(gctx)
+        self.cells = dict([(name, [function]) for name, function in self.functions.iteritems()])
+        self.pool = None
+        self.tasks = 0 # Number of expressions sent to workers
+
+        self.nodes = [] # Node number to node and definition it is in
+        self.keys = {} # Node id and definition name to node number
+        self.compiled = {} # Node number to closure
+        self.cost = {} # Node id or function name to estimated cost
+        self.splits = {} # Node id or function name to whether evaluation has parallelism in it
+
+        # Callees come before callers, recursive groups cost the same
+        for component in self.graph.components:
+            if not self.graph.is_reachable(component[0]):
+                continue
+            recursive = self.graph.is_recursive(component[0])
+            for name in component:
+                self.cost[name] = RECURSIVE if recursive else self.estimate(self.gctx[name])
+                self.splits[name] = False
+            changed = True
+            while changed:
+                changed = False
+                for name in component:
+                    splits = self.mark(self.gctx[name])
+                    if splits != self.splits[name]:
+                        self.splits[name] = splits
+                        changed = True
+
+    def walk(self, d):
+        """
+        Yield nodes of definition body, children before their parents
+        """
+        stack = [(d.body, False)]
+        seen = set()
+        while stack:
+            node, expanded = stack.pop()
+            if id(node) in seen:
+                continue
+            children = node.children()
+            if not expanded and children:
+                stack.append((node, True))
+                stack.extend([(child, False) for child in children])
+                continue
+            seen.add(id(node))
+            yield node
+
+    def estimate(self, d):
+        """
+        Estimate cost of nodes in definition body, return cost of the body
+        """
+        for node in self.walk(d):
+            if (id(node), d.name) not in self.keys:
+                self.keys[id(node), d.name] = len(self.nodes)
+                self.nodes.append((node, d))
+            cost = 1 + sum([self.cost[id(child)] for child in node.children()])
+            if isinstance(node, absy.Apply) and node.func_name in self.cost:
+                cost += self.cost[node.func_name]
+            self.cost[id(node)] = cost
+        return self.cost[id(d.body)]
+
+    def mark(self, d):
+        """
+        Mark nodes of definition body that have parallelism in them,
+        return whether the body has
+        """
+        if (id(d.body), d.name) not in self.keys:
+            self.estimate(d)
+        for node in self.walk(d):
+            children = node.children()
+            splits = any([self.splits[id(child)] for child in children])
+            if isinstance(node, absy.Apply):
+                splits = splits or len(self.expensive(node)) >= 2 or self.splits.get(node.func_name, False)
+            self.splits[id(node)] = splits
+        return self.splits[id(d.body)]
+
+    def expensive(self, node):
+        return [i for i, child in enumerate(node.children()) if self.cost[id(child)] >= self.threshold]
+
+    def inline(self, key):
+        """
+        Closure evaluating node number key in the current process
+        """
+        if key not in self.compiled:
+            node, d = self.nodes[key]
+            self.compiled[key] = closures.compile_definition(absy.Definition(d.name, d.args, d.return_type, node, d.token), self.gctx, self.cells)
+        return self.compiled[key]
+
+    def evaluate(self, node, d, env):
+        """
+        Evaluate node of definition d with arguments in env
+        """
+        if not self.splits[id(node)] or self.tasks >= self.max_tasks:
+            return self.inline(self.keys[id(node), d.name])(env)
+        if isinstance(node, absy.Conditional):
+            if self.evaluate(node.expr_if, d, env):
+                return self.evaluate(node.expr_then, d, env)
+            return self.evaluate(node.expr_else, d, env)
+
+        # Send all expensive arguments but one to workers, evaluate others meanwhile
+        expensive = self.expensive(node)
+        pending = {}
+        if len(expensive) >= 2:
+            for i in expensive[1:]:
+                pending[i] = self.pool.apply_async(evaluate_task, ((self.keys[id(node.parameters[i]), d.name], env),))
+                self.tasks += 1
+        values = [None if i in pending else self.evaluate(p, d, env) for i, p in enumerate(node.parameters)]
+        for i, result in pending.iteritems():
+            values[i] = result.get()
+
+        f = self.gctx[node.func_name]
+        if isinstance(f, absy.DefinitionBuiltin):
+            return f.evaluate(values, self.gctx)
+        if self.splits[f.name]:
+            return self.evaluate(f.body, f, tuple(values))
+        return self.functions[f.name](tuple(values))
+
+    def run(self, processes=None):
+        """
+        Evaluate MAIN with pool of processes
+        """
+        global program
+        processes = processes or cpu_count()
+        d = self.gctx["MAIN"]
+        if processes == 1:
+            return self.functions["MAIN"](())
+        program = self
+        self.max_tasks = self.tasks + processes * self.tasks_per_process
+        try:
+            self.pool = Pool(processes)
+            try:
+                return self.evaluate(d.body, d, ())
+            finally:
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
+        finally:
+            program = None
+
+def interpret(filename, processes=None, threshold=DEFAULT_THRESHOLD, tasks_per_process=4):
+    gctx, errors = astcache.front_end(filename)
+
+    if errors:
+        for node, msg in errors:
+            print msg, "on line", node.line, "column", node.column
+
+    else:
+        return ParallelEvaluator(gctx, threshold, tasks_per_process).run(processes)
+
+if __name__ == "__main__":
+    filename, = sys.argv[1:]
+    print "The MAIN function returned:", interpret(filename)
@@ -0,0 +1,88 @@
+# coding: utf-8
+"""
+Parallel front end, the source is split at DEF tokens and the pieces
+are lexed and parsed in a pool of worker processes
+"""
+
+import re
+import sys
+from multiprocessing import Pool, cpu_count
+import lexer
+from parser import CursorParser
+
+# DEF is a token wherever it is not preceded by a word character,
+# comments are matched as well so that DEF inside a comment is skipped.
+# Missing a DEF only makes a piece bigger, each piece may contain several definitions.
+SPLIT_REGEX = re.compile(r"--.*\n|(?<!\w)DEF")
+
+def split(source, pieces):
+    """
+    Split source at DEF tokens into roughly equal sized pieces,
+    return list of (start, end, line, column) tuples where line and column
+    are the position of the first character of the piece in the source
+    """
+    size = len(source) / pieces + 1
+    result = []
+    start = 0
+    line = 1
+    found = False
+    for m in SPLIT_REGEX.finditer(source):
+        if m.group() != "DEF":
+            continue
+        if not found or m.start() - start < size:
+            # Every piece must contain at least one definition
+            found = True
+            continue
+        result.append((start, m.start(), line, column_at(source, start)))
+        line += source.count("\n", start, m.start())
+        start = m.start()
+    result.append((start, len(source), line, column_at(source, start)))
+    return result
+
+def column_at(source, position):
+    """
+    Column numbers follow lexer: first line starts at column 1, the rest at column 0
+    """
+    newline = source.rfind("\n", 0, position)
+    if newline < 0:
+        return position + 1
+    return position - newline - 1
+
+# Forked workers inherit the source from parent instead of receiving it through a pipe
+source = None
+
+def parse_piece(piece):
+    start, end, line, column = piece
+    defs, state = CursorParser(tuple(lexer.tokenize_source(source[start:end], line, column))).parse()
+    return defs
+
+def parse_source(text, processes=None, pieces_per_process=4):
+    """
+    Parse source in parallel and return function definitions in source order
+    """
+    global source
+    source = text
+    processes = processes or cpu_count()
+    pieces = split(text, processes * pieces_per_process)
+    try:
+        if processes == 1 or len(pieces) == 1:
+            results = map(parse_piece, pieces)
+        else:
+            pool = Pool(processes)
+            try:
+                results = pool.map(parse_piece, pieces)
+            finally:
+                pool.close()
+                pool.join()
+    finally:
+        source = None
+    return [d for defs in results for d in defs]
+
+def parse(filename, processes=None):
+    return parse_source(open(filename).read(), processes)
+
+if __name__ == "__main__":
+    filename, = sys.argv[1:]
+    print "Parsed defs:"
+    for d in parse(filename):
+        print d
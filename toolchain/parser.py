@@ -40,18 +40,22 @@ Expr3   ::=  'FI' 10
 
 class ParseError(StandardError):
     def __init__(self, message, token):
+        StandardError.__init__(self, message, token) # Keeps the error picklable
         self.message = message
         self.token = token
 
     def __str__(self):
         if self.token:
-            return "%s on line %d column %d" % (self.message, 1,2)#self.token.line, self.token.column)
+            return "%s on line %d column %d" % (self.message, self.token.line, self.token.column)
         return self.message
 
 class Parser(object):
     """
     Parser object represents the tokens that haven't been parsed yet
     """
+    # Syntax tree nodes are constructed through this, see hashcons.Interner
+    nodes = absy
+
     def __init__(self, head, *tail):
         self.head = head
         self.tail = tail
@@ -71,39 +75,35 @@ class Parser(object):
                     argument_token, state = state.pop(lexer.TokenIdentifier)
                     type_token, state = state.skip(lexer.TokenColon).pop(lexer.TokenType)
                     arguments = arguments + ((argument_token.lexeme, type_token.lexeme),)
-                    token, state = state.pop(lexer.TokenClose, lexer.TokenComma)
-                    if isinstance(token, lexer.TokenClose):
+                    if state.peek(lexer.TokenClose):
+                        state = state.skip(lexer.TokenClose)
                         break
+                    state = state.skip(lexer.TokenClose, lexer.TokenComma)
             else:
                 state = state.skip(lexer.TokenClose)
         
         return_type, state = state.skip(lexer.TokenColon).pop(lexer.TokenType)
         body_expression, state = state.skip(lexer.TokenDefAs).parse_expression()
-        return absy.Definition(function_name_identifier.lexeme, arguments, return_type.lexeme, body_expression, def_token), state
+        return state.nodes.Definition(function_name_identifier.lexeme, arguments, return_type.lexeme, body_expression, def_token), state
     
 
     def parse_nat(state): # semantic action 5
-        return absy.Nat(state.head.lexeme), state.skip(lexer.TokenNat)
+        return state.nodes.Nat(state.head.lexeme), state.skip(lexer.TokenNat)
 
     def parse_true(state): # semantic action 6
-        return absy.Boolean(True), state.skip(lexer.TokenTrue)
+        return state.nodes.Boolean(True), state.skip(lexer.TokenTrue)
         
     def parse_false(state): # semantic action 7
-        return absy.Boolean(False), state.skip(lexer.TokenFalse)
+        return state.nodes.Boolean(False), state.skip(lexer.TokenFalse)
 
     def parse_conditional(state): # semantic action 8
         """
         Parse conditional expression
         """
-        expr_if, state = state.skip(lexer.TokenIf).parse_expression()
-        expr_then, state = state.skip(lexer.TokenThen).parse_expression()
-        if state.peek(lexer.TokenElse):
-            expr_else, state = state.skip(lexer.TokenElse).parse_expression()
-            expr = absy.Conditional(expr_if, expr_then, expr_else)
-        else:
-            expr = absy.Conditional(expr_if, expr_then)
-        return expr, state.skip(lexer.TokenFi)
-                
+        if not state.peek(lexer.TokenIf):
+            state.skip(lexer.TokenIf) # Raises ParseError
+        return state.parse_expression()
+
     def parse_expression(state):
         """
         Expr ::= number 5
@@ -111,43 +111,69 @@ class Parser(object):
                | false 7
                | id Expr1
                | 'IF' Expr 'THEN' Expr Expr3
+
+        Nested applications and conditionals are kept on an explicit stack
+        instead of Python call stack, so deeply nested expressions don't hit
+        the recursion limit. Stack holds (token, subexpressions, conditional)
+        where token is the function name for applications and IF for conditionals.
         """
-        if isinstance(state.head, lexer.TokenTrue):
-            expr, state = state.parse_true()
-        elif isinstance(state.head, lexer.TokenFalse):
-            expr, state = state.parse_false()
-        elif isinstance(state.head, lexer.TokenIdentifier):
-            expr, state = state.parse_identifier()
-        elif isinstance(state.head, lexer.TokenNat):
-            expr, state = state.parse_nat()
-        elif isinstance(state.head, lexer.TokenIf):
-            expr, state = state.parse_conditional()
-        else:
-            raise ParseError("This should not happen")
-        return expr, state
+        stack = []
+        while True:
+            if state.peek(lexer.TokenTrue):
+                expr, state = state.parse_true()
+            elif state.peek(lexer.TokenFalse):
+                expr, state = state.parse_false()
+            elif state.peek(lexer.TokenNat):
+                expr, state = state.parse_nat()
+            elif state.peek(lexer.TokenIdentifier):
+                token, state = state.pop(lexer.TokenIdentifier)
+                if state.peek(lexer.TokenOpen):
+                    # This is function application, parse parameters first
+                    state = state.skip(lexer.TokenOpen)
+                    stack.append((token, [], False))
+                    continue
+                # This is a variable
+                expr = state.nodes.Variable(token.lexeme, token)
+            elif state.peek(lexer.TokenIf):
+                token, state = state.pop(lexer.TokenIf)
+                stack.append((token, [], True))
+                continue
+            else:
+                raise ParseError("Got " + repr(state.head) + " of class " + state.head_class().__name__ + ", was expecting expression", state.head)
+
+            # Attach complete expression to pending applications and conditionals
+            while stack:
+                token, subexpressions, conditional = stack[-1]
+                subexpressions.append(expr)
+                if conditional:
+                    if len(subexpressions) == 1:
+                        state = state.skip(lexer.TokenThen)
+                        break
+                    if len(subexpressions) == 2 and state.peek(lexer.TokenElse):
+                        state = state.skip(lexer.TokenElse)
+                        break
+                    expr = state.nodes.Conditional(*subexpressions, token=token)
+                    state = state.skip(lexer.TokenFi)
+                else:
+                    if state.peek(lexer.TokenComma):
+                        state = state.skip(lexer.TokenComma)
+                        break
+                    if not state.peek(lexer.TokenClose):
+                        break
+                    expr = state.nodes.Apply(token.lexeme, tuple(subexpressions), token)
+                    state = state.skip(lexer.TokenClose)
+                stack.pop()
+            else:
+                return expr, state
 
     def parse_identifier(state):
         """
         Expr1 ::= '(' Expr2
                 | eps 8  //Follow(Expr1) = Follow(Expr) = {',', 'eof', 'THEN', 'FI', 'ELSE', ',', '),}
         """
-        token, state = state.pop(lexer.TokenIdentifier)
-        if state.peek(lexer.TokenOpen):
-            # This is function application
-            state = state.skip(lexer.TokenOpen)
-            parameters = ()
-            while True:
-                parameter, state = state.parse_expression()
-                parameters = parameters + (parameter,)
-                if state.peek(lexer.TokenComma):
-                    state = state.skip(lexer.TokenComma)
-                    continue
-                if state.peek(lexer.TokenClose):
-                    break
-            return absy.Apply(token.lexeme, parameters, token), state.skip(lexer.TokenClose)
-        else:
-            # This is a variable
-            return absy.Variable(token.lexeme, token), state
+        if not state.peek(lexer.TokenIdentifier):
+            state.skip(lexer.TokenIdentifier) # Raises ParseError
+        return state.parse_expression()
         
 
     def parse(state):
@@ -160,33 +186,98 @@ class Parser(object):
             d, state = state.parse_definition()
             defs.append(d)
         return defs, state # state.skip(lexer.TokenEndOfFile)
+
+    def definitions(state):
+        """
+        Generate function definition nodes one by one as they are parsed
+        """
+        while True:
+            d, state = state.parse_definition()
+            yield d
+            if state.peek(lexer.TokenEndOfFile):
+                break
         
     def pop(state, *token_classes):
         """
         Check whether the head of tokens is instance of any of the required classes, return it if it is otherwise throw exception
         """
+        token = state.head
+        return token, state.skip(*token_classes)
+
+        
+    def advance(state):
+        """
+        Return parser state for the tokens after the head
+        """
+        return Parser(*state.tail)
+
+    def head_class(state):
+        return state.head.__class__
+
+    def peek(state, token_class):
+        return isinstance(state.head, token_class)
+
+
+    def skip(state, *token_classes):
+        """
+        Check whether the head of tokens is instance of any of the required classes and advance past it
+        """
         for token_class in token_classes:
-            if isinstance(state.head, token_class):
-                return state.head, Parser(*state.tail)
+            if state.peek(token_class):
+                return state.advance()
 
         # No token class was matched, raise exception.
         # Note that as parsing is very strict it does not make much sense to
         # gather all error messages because the subsequent ones don't make much sense.
-        raise ParseError("Got " + repr(state.head) + " of class " + state.head.__class__.__name__ + ", was expecting " + " or ".join([tc.__name__ for tc in token_classes]), state.head)
+        raise ParseError("Got " + repr(state.head) + " of class " + state.head_class().__name__ + ", was expecting " + " or ".join([tc.__name__ for tc in token_classes]), state.head)
 
-        
-    def peek(state, token_class):
-        return isinstance(state.head, token_class)
+class StreamParser(Parser):
+    """
+    Parser which pulls tokens lazily from an iterator so that only the head
+    is kept in memory. Note that the state is not persistent,
+    popping a token advances the same object.
+    """
+    def __init__(self, tokens, nodes=absy):
+        self.tokens = iter(tokens)
+        self.head = next(self.tokens)
+        self.nodes = nodes
 
+    def advance(state):
+        state.head = next(state.tokens)
+        return state
 
-    def skip(state, *token_classes):
-        token, state = state.pop(*token_classes)
+class CursorParser(Parser):
+    """
+    Parser over a shared sequence of tokens, the state is an index into
+    the sequence. Like StreamParser the state is advanced in place.
+    """
+    def __init__(self, tokens, nodes=absy):
+        self.tokens = tokens
+        self.index = 0
+        self.nodes = nodes
+
+    @property
+    def head(state):
+        return state.tokens[state.index]
+
+    def advance(state):
+        state.index += 1
         return state
 
+class TokenStreamParser(CursorParser):
+    """
+    Parser over lexer.TokenStream, tokens are matched by their kind codes
+    so token views are created only for tokens that are popped
+    """
+    def head_class(state):
+        return state.tokens.kind(state.index)
+
+    def peek(state, token_class):
+        return issubclass(state.tokens.kind(state.index), token_class)
+
 if __name__ == "__main__":
     filename, = sys.argv[1:]
-    tokens = tuple(lexer.tokenize(filename))
-    defs, state = Parser(*tokens).parse()
+    defs, state = StreamParser(lexer.tokenize(filename)).parse()
     print "Parsed defs:"
     for d in defs:
         print d
@@ -0,0 +1,207 @@
+# coding: utf-8
+"""
+Partial evaluation of checked program. Built-in functions applied to
+literals are folded, conditionals with literal condition are replaced by
+the branch taken, calls with literal arguments are evaluated and calls
+with some literal arguments call a copy of the function specialized on
+them. The result is global context like the one front end returns, so
+every backend can consume it:
+
+    gctx = partial.reduce(gctx)
+    coder.compile_program(gctx)
+
+User defined functions may not terminate, so evaluating a call or
+specializing a function uses up one unit of fuel. Once fuel runs out,
+calls are left as they are. Results which are not natural numbers or
+booleans, such as negative differences, and division by zero are left
+for run time too.
+"""
+
+import sys
+import absy
+import astcache
+import callgraph
+import inliner
+
+DEFAULT_FUEL = 1000
+MAX_DEPTH = 100 # Nesting of calls evaluated at once, Python stack is limited
+
+def literal(value):
+    """
+    Syntax tree node for value, None if value has no literal
+    """
+    if isinstance(value, bool):
+        return absy.Boolean(value)
+    if value >= 0:
+        return absy.Nat(value)
+    return None
+
+class PartialEvaluator(object):
+    def __init__(self, gctx, fuel=DEFAULT_FUEL):
+        self.gctx = gctx
+        self.fuel = fuel
+        self.depth = 0
+        self.results = {} # Function name and argument values to literal, None if call could not be evaluated
+        self.specialized = {} # Function name and argument values, None for others, to specialized definition
+
+    def reduce(self, root="MAIN"):
+        """
+        Return global context where functions reachable from root are reduced
+        """
+        graph = callgraph.CallGraph(self.gctx, root)
+        result = dict(self.gctx)
+        for component in graph.components:
+            for name in component:
+                if name in graph.reachable:
+                    d = self.gctx[name]
+                    result[name] = absy.Definition(d.name, d.args, d.return_type, self.expression(d.body, {}), d.token)
+        for d in self.specialized.itervalues():
+            result[d.name] = d
+        return result
+
+    def expression(self, node, env):
+        """
+        Return reduced expression, variables in env are replaced by the
+        literals there. Nodes which do not change are reused. Conditionals
+        are reduced in steps: condition first, then the branch taken or
+        both branches if the condition is not literal
+        """
+        root = node
+        reduced = {}
+        stack = [(node, "expand")]
+        while stack:
+            node, step = stack.pop()
+            if step == "expand" and id(node) in reduced:
+                continue
+
+            if isinstance(node, absy.Conditional):
+                if step == "expand":
+                    stack.append((node, "condition"))
+                    stack.append((node.expr_if, "expand"))
+                elif step == "condition":
+                    condition = reduced[id(node.expr_if)]
+                    if isinstance(condition, absy.Boolean) and (condition.value or node.expr_else is not None):
+                        # Branch which is not taken is not reduced, it may recurse forever
+                        taken = node.expr_then if condition.value else node.expr_else
+                        stack.append((node, "taken"))
+                        stack.append((taken, "expand"))
+                    else:
+                        stack.append((node, "finish"))
+                        stack.extend([(child, "expand") for child in node.children()[1:]])
+                elif step == "taken":
+                    condition = reduced[id(node.expr_if)]
+                    reduced[id(node)] = reduced[id(node.expr_then if condition.value else node.expr_else)]
+                else:
+                    reduced[id(node)] = inliner.rebuild(node, [reduced[id(child)] for child in node.children()])
+                continue
+
+            children = node.children()
+            if step == "expand" and children:
+                stack.append((node, "reduce"))
+                stack.extend([(child, "expand") for child in children])
+                continue
+            parameters = [reduced[id(child)] for child in children]
+
+            if isinstance(node, absy.Variable):
+                reduced[id(node)] = literal(env[node.name].value) if node.name in env else node
+            elif isinstance(node, absy.Value):
+                reduced[id(node)] = node
+            elif isinstance(node, absy.Apply):
+                reduced[id(node)] = self.apply(node, parameters)
+            else:
+                raise Exception("Don't know how to reduce: %s of class %s" % (node, node.__class__.__name__))
+        return reduced[id(root)]
+
+    def apply(self, node, parameters):
+        f = self.gctx[node.func_name]
+        constant = [isinstance(p, absy.Value) for p in parameters]
+        if isinstance(f, absy.DefinitionBuiltin):
+            if all(constant):
+                try:
+                    value = literal(f.evaluate([p.value for p in parameters], self.gctx))
+                except ZeroDivisionError:
+                    value = None
+                if value is not None:
+                    return value
+        elif all(constant):
+            value = self.call(f, parameters)
+            if value is not None:
+                return value
+        elif any(constant):
+            d = self.specialize(f, parameters)
+            if d is not None:
+                return self.rebuild(node, d.name, [p for p, c in zip(parameters, constant) if not c])
+        return self.rebuild(node, node.func_name, parameters)
+
+    def rebuild(self, node, func_name, parameters):
+        if func_name == node.func_name and all([p is q for p, q in zip(parameters, node.parameters)]):
+            return node
+        reduced = absy.Apply(func_name, tuple(parameters), node.token)
+        reduced.type = node.type
+        return reduced
+
+    def call(self, f, parameters):
+        """
+        Literal value of call with literal parameters, None if it could
+        not be evaluated with the fuel left
+        """
+        key = (f.name,) + tuple([p.value for p in parameters])
+        if key not in self.results:
+            if self.fuel <= 0 or self.depth >= MAX_DEPTH:
+                return None
+            self.fuel -= 1
+            self.depth += 1
+            try:
+                body = self.expression(f.body, dict(zip([arg_name for arg_name, arg_type in f.args], parameters)))
+            finally:
+                self.depth -= 1
+            self.results[key] = body if isinstance(body, absy.Value) else None
+        if self.results[key] is None:
+            return None
+        return literal(self.results[key].value)
+
+    def specialize(self, f, parameters):
+        """
+        Definition of f specialized on literal parameters, it takes the
+        rest of the parameters. None if fuel has run out
+        """
+        key = (f.name,) + tuple([p.value if isinstance(p, absy.Value) else None for p in parameters])
+        if key not in self.specialized:
+            if self.fuel <= 0 or self.depth >= MAX_DEPTH:
+                return None
+            self.fuel -= 1
+            name = "%s{%s}" % (f.name, ",".join([repr(p) if isinstance(p, absy.Value) else "_" for p in parameters]))
+            args = tuple([arg for arg, p in zip(f.args, parameters) if not isinstance(p, absy.Value)])
+            d = absy.Definition(name, args, f.return_type, None, f.token)
+            # Recursive calls with the same literals call the definition being specialized
+            self.specialized[key] = d
+            self.depth += 1
+            try:
+                d.body = self.expression(f.body, dict([(arg_name, p) for (arg_name, arg_type), p in zip(f.args, parameters) if isinstance(p, absy.Value)]))
+            finally:
+                self.depth -= 1
+        return self.specialized[key]
+
+def reduce(gctx, fuel=DEFAULT_FUEL, root="MAIN"):
+    return PartialEvaluator(gctx, fuel).reduce(root)
+
+def front_end(filename, fuel=DEFAULT_FUEL):
+    """
+    Return reduced global context of source file and errors found in it
+    """
+    gctx, errors = astcache.front_end(filename)
+    if errors:
+        return gctx, errors
+    return reduce(gctx, fuel), errors
+
+if __name__ == "__main__":
+    filename = sys.argv[1]
+    fuel = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_FUEL
+    gctx, errors = front_end(filename, fuel)
+    if errors:
+        for node, msg in errors:
+            print msg, "on line", node.line, "column", node.column
+    else:
+        for d in callgraph.prune(gctx).itervalues():
+            if not isinstance(d, absy.DefinitionBuiltin):
+                print d
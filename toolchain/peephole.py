@@ -0,0 +1,233 @@
+# coding: utf-8
+"""
+Peephole optimizer for UEBB instructions. Instructions are rewritten
+before labels are resolved, so jumps still refer to labels by name.
+A rule looks at instruction i of the code and returns the number of
+instructions it consumes and their replacement, or None if it does not
+apply. Passes are made over the code until no rule applies:
+
+    optimizer = peephole.Optimizer()
+    instructions = coder.compile_program(gctx, optimize=optimizer)
+    print optimizer.report()
+
+Rules are tried in order at every instruction of the classes they are
+triggered by, other rule sets can be passed to the optimizer.
+"""
+
+import ir
+
+def triggered_by(*classes):
+    """
+    Decorator for rules that apply only at instructions of given classes
+    """
+    def decorate(rule):
+        rule.triggers = classes
+        return rule
+    return decorate
+
+def is_push(i):
+    return isinstance(i, ir.PushInt) or (type(i) is ir.Push)
+
+def is_jump(i):
+    return type(i) is ir.Jump
+
+def is_transfer(i):
+    """
+    Whether the instruction never continues to the next one
+    """
+    return is_jump(i) or isinstance(i, ir.Return) or isinstance(i, ir.Stop)
+
+class Context(object):
+    """
+    Labels of the code a pass is made over
+    """
+    def __init__(self, code):
+        self.code = code
+        self.labels = {} # Label name to index
+        self.references = {} # Label name to number of instructions referring to it
+        for index, i in enumerate(code):
+            if isinstance(i, ir.Label):
+                self.labels[i.name] = index
+            elif isinstance(i, ir.Jump) or isinstance(i, ir.PushAddr):
+                self.references[i.target] = self.references.get(i.target, 0) + 1
+
+    def destination(self, name):
+        """
+        Index of the first instruction executed after jumping to label
+        """
+        index = self.labels[name]
+        while index < len(self.code) and isinstance(self.code[index], ir.Label):
+            index += 1
+        return index
+
+    def follows(self, index, name):
+        """
+        Whether label is among the labels right after index
+        """
+        index += 1
+        while index < len(self.code) and isinstance(self.code[index], ir.Label):
+            if self.code[index].name == name:
+                return True
+            index += 1
+        return False
+
+@triggered_by(ir.PushInt, ir.Push)
+def swap_pushes(code, i, context):
+    """
+    X, Y, Swap pushes in the other order, offsets are adjusted for the
+    item which is no longer on the stack or is there in addition
+    """
+    if i + 2 >= len(code) or not (is_push(code[i]) and is_push(code[i+1]) and isinstance(code[i+2], ir.Swap)):
+        return None
+    first, second = code[i], code[i+1]
+    if type(second) is ir.Push:
+        if second.name == 0: # Reads the item first pushed
+            return None
+        second = ir.Push(second.name - 1)
+    if type(first) is ir.Push:
+        first = ir.Push(first.name + 1)
+    return 3, [second, first]
+
+@triggered_by(ir.Push)
+def duplicate_swap(code, i, context):
+    """
+    Swapping top of the stack with its copy does nothing
+    """
+    if i + 1 < len(code) and type(code[i]) is ir.Push and code[i].name == 0 and isinstance(code[i+1], ir.Swap):
+        return 2, [code[i]]
+    return None
+
+@triggered_by(ir.Push)
+def duplicate_slide(code, i, context):
+    """
+    Copy of top of the stack slid over the original does nothing
+    """
+    if i + 1 < len(code) and type(code[i]) is ir.Push and code[i].name == 0 and \
+            isinstance(code[i+1], ir.Slide) and code[i+1].offset == 1:
+        return 2, []
+    return None
+
+@triggered_by(ir.Jump, ir.Return, ir.Stop)
+def dead_code(code, i, context):
+    """
+    Instructions after unconditional transfer are not executed unless
+    they are jumped to
+    """
+    if not is_transfer(code[i]):
+        return None
+    j = i + 1
+    while j < len(code) and not isinstance(code[j], ir.Label):
+        j += 1
+    if j == i + 1:
+        return None
+    return j - i, [code[i]]
+
+@triggered_by(ir.Jump)
+def jump_next(code, i, context):
+    """
+    Jump to the next instruction does nothing
+    """
+    if is_jump(code[i]) and context.follows(i, code[i].target):
+        return 1, []
+    return None
+
+@triggered_by(ir.Jump)
+def jump_thread(code, i, context):
+    """
+    Jump to another jump goes where the last jump of the chain goes
+    """
+    if not isinstance(code[i], ir.Jump) or code[i].target not in context.labels:
+        return None
+    target = code[i].target
+    seen = set([target])
+    while True:
+        index = context.destination(target)
+        if index >= len(code) or not is_jump(code[index]) or code[index].target in seen:
+            break
+        target = code[index].target
+        seen.add(target)
+    if target == code[i].target:
+        return None
+    return 1, [code[i].__class__(target)]
+
+@triggered_by(ir.Jump)
+def jump_return(code, i, context):
+    """
+    Jump to Ret or Stop can return or stop right away
+    """
+    if not is_jump(code[i]) or code[i].target not in context.labels:
+        return None
+    index = context.destination(code[i].target)
+    if index < len(code) and (isinstance(code[index], ir.Return) or isinstance(code[index], ir.Stop)):
+        return 1, [code[index].__class__()]
+    return None
+
+@triggered_by(ir.Label)
+def unused_label(code, i, context):
+    """
+    Label that is not referred to does not need to be kept
+    """
+    if isinstance(code[i], ir.Label) and not context.references.get(code[i].name):
+        return 1, []
+    return None
+
+RULES = (
+    swap_pushes,
+    duplicate_swap,
+    duplicate_slide,
+    jump_thread,
+    jump_return,
+    jump_next,
+    dead_code,
+    unused_label
+)
+
+class Optimizer(object):
+    def __init__(self, rules=RULES, max_passes=100):
+        self.rules = rules
+        self.max_passes = max_passes
+        self.hits = dict([(rule.__name__, 0) for rule in rules]) # Rule name to number of rewrites
+        self.dispatch = {} # Instruction class to rules triggered by it
+
+    def rules_for(self, instruction):
+        cls = instruction.__class__
+        if cls not in self.dispatch:
+            self.dispatch[cls] = [rule for rule in self.rules if isinstance(instruction, getattr(rule, "triggers", ir.Instruction))]
+        return self.dispatch[cls]
+
+    def optimize_pass(self, code):
+        """
+        Return rewritten code and whether any rule applied
+        """
+        context = Context(code)
+        result = []
+        changed = False
+        i = 0
+        while i < len(code):
+            for rule in self.rules_for(code[i]):
+                rewrite = rule(code, i, context)
+                if rewrite is not None:
+                    consumed, replacement = rewrite
+                    result.extend(replacement)
+                    self.hits[rule.__name__] += 1
+                    changed = True
+                    i += consumed
+                    break
+            else:
+                result.append(code[i])
+                i += 1
+        return result, changed
+
+    def optimize(self, instructions):
+        code = list(instructions)
+        for n in range(self.max_passes):
+            code, changed = self.optimize_pass(code)
+            if not changed:
+                break
+        return code
+
+    def report(self):
+        return "\n".join(["%-20s %6d" % (rule.__name__, self.hits[rule.__name__]) for rule in self.rules])
+
+def optimize(instructions):
+    return Optimizer().optimize(instructions)
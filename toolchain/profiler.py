@@ -0,0 +1,138 @@
+# coding: utf-8
+"""
+Profiler for the interpreter, definitions in global context are
+substituted with stand-ins that record calls to them. Nothing is
+substituted unless profiling is asked for, so there is no cost otherwise:
+
+    profile = profiler.Profiler()
+    interpreter.interpret("examples/sqrt.mo", profile=profile)
+    print profile.report()
+
+For every user defined and built-in function the number of calls,
+inclusive and exclusive time and maximum recursion depth is recorded.
+Time is attributed to call stacks too, these are written in the collapsed
+format read by flame graph tools.
+"""
+
+import sys
+import json
+from timeit import default_timer as clock
+
+class Stats(object):
+    __slots__ = "calls", "inclusive", "exclusive", "max_depth"
+
+    def __init__(self):
+        self.calls = 0
+        self.inclusive = 0.0 # Time spent in outermost calls, including callees
+        self.exclusive = 0.0 # Time spent in the function itself
+        self.max_depth = 0
+
+class ProfiledDefinition(object):
+    """
+    Stand-in for definition in global context, calls are recorded by profiler
+    """
+    def __init__(self, definition, profiler):
+        self.definition = definition
+        self.profiler = profiler
+
+    def __getattr__(self, name):
+        return getattr(self.definition, name)
+
+    def evaluate(self, parameters, gctx={}):
+        self.profiler.enter(self.definition.name)
+        try:
+            return self.definition.evaluate(parameters, gctx)
+        finally:
+            self.profiler.leave()
+
+class Profiler(object):
+    def __init__(self):
+        self.stats = {} # Function name to Stats
+        self.stacks = {} # Collapsed call stack to exclusive time
+        self.caches = {} # Function name to memo cache
+        self.depth = {} # Function name to number of its calls in progress
+        self.frames = [] # Call stack, path, start time and time spent in callees
+
+    def instrument(self, gctx, caches={}):
+        """
+        Return global context where all functions are profiled,
+        memo caches are reported along with the functions
+        """
+        self.caches.update(caches)
+        return dict([(name, ProfiledDefinition(d, self)) for name, d in gctx.iteritems()])
+
+    def enter(self, name):
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = Stats()
+        stats.calls += 1
+        depth = self.depth.get(name, 0) + 1
+        self.depth[name] = depth
+        if depth > stats.max_depth:
+            stats.max_depth = depth
+        path = self.frames[-1][0] + ";" + name if self.frames else name
+        self.frames.append([path, name, clock(), 0.0])
+
+    def leave(self):
+        path, name, started, callees = self.frames.pop()
+        elapsed = clock() - started
+        stats = self.stats[name]
+        stats.exclusive += elapsed - callees
+        self.depth[name] -= 1
+        if not self.depth[name]:
+            stats.inclusive += elapsed
+        if self.frames:
+            self.frames[-1][3] += elapsed
+        self.stacks[path] = self.stacks.get(path, 0.0) + elapsed - callees
+
+    def report(self):
+        """
+        Return text table of functions, slowest first
+        """
+        lines = ["%-20s %10s %12s %12s %10s %12s" % ("Function", "Calls", "Inclusive", "Exclusive", "Max depth", "Memo hits")]
+        for name, stats in sorted(self.stats.iteritems(), key=lambda item: -item[1].inclusive):
+            cache = self.caches.get(name)
+            memo = "%d/%d" % (cache.hits, cache.hits + cache.misses) if cache else "-"
+            lines.append("%-20s %10d %11.6fs %11.6fs %10d %12s" % (name, stats.calls, stats.inclusive, stats.exclusive, stats.max_depth, memo))
+        return "\n".join(lines)
+
+    def to_json(self):
+        """
+        Return statistics as JSON, times are in seconds
+        """
+        functions = {}
+        for name, stats in self.stats.iteritems():
+            functions[name] = {
+                "calls": stats.calls,
+                "inclusive": stats.inclusive,
+                "exclusive": stats.exclusive,
+                "max_depth": stats.max_depth
+            }
+            cache = self.caches.get(name)
+            if cache:
+                functions[name]["memo"] = {
+                    "hits": cache.hits,
+                    "misses": cache.misses,
+                    "evictions": cache.evictions,
+                    "size": len(cache)
+                }
+        return json.dumps({"functions": functions}, indent=4, sort_keys=True)
+
+    def collapsed(self):
+        """
+        Return call stacks in collapsed format, exclusive time in microseconds
+        """
+        return "".join(["%s %d\n" % (path, round(elapsed * 1e6)) for path, elapsed in sorted(self.stacks.iteritems())])
+
+if __name__ == "__main__":
+    import interpreter
+    filename = sys.argv[1]
+    profile = Profiler()
+    print "The MAIN function returned:", interpreter.interpret(filename, profile=profile)
+    print profile.report()
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], "w") as fh:
+            fh.write(profile.to_json())
+    if len(sys.argv) > 3:
+        with open(sys.argv[3], "w") as fh:
+            fh.write(profile.collapsed())
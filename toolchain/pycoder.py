@@ -0,0 +1,195 @@
+# coding: utf-8
+"""
+µ-Opal to Python source compiler. Every definition becomes a Python
+function, conditionals become conditional expressions, built-ins become
+operators and self tail calls become while loops. The source is loaded
+with exec and cached next to the µ-Opal source file:
+
+    functions = compile_file("examples/sqrt.mo")
+    functions["MAIN"]()
+"""
+
+import os
+import re
+import sys
+import hashlib
+import absy
+import astcache
+import builtin
+import callgraph
+
+OPERATORS = {
+    builtin.DefinitionEq:       "==",
+    builtin.DefinitionLessThan: "<",
+    builtin.DefinitionAdd:      "+",
+    builtin.DefinitionSub:      "-",
+    builtin.DefinitionMul:      "*",
+    builtin.DefinitionDiv:      "/"
+}
+
+def toolchain_version():
+    digest = hashlib.sha1(astcache.VERSION)
+    with open(os.path.splitext(__file__)[0] + ".py", "rb") as fh:
+        digest.update(fh.read())
+    return digest.hexdigest()
+
+VERSION = toolchain_version()
+
+def mangle(prefix, name):
+    """
+    Python identifier for µ-Opal name, characters other than letters and
+    digits are escaped so that names can not collide with each other or
+    with Python keywords
+    """
+    return prefix + re.sub("[^A-Za-z0-9]", lambda m: "_%02x" % ord(m.group()), name)
+
+def function_name(name):
+    return mangle("f_", name)
+
+def variable_name(name):
+    return mangle("v_", name)
+
+def expression(node, gctx):
+    """
+    Python expression for µ-Opal expression, children are translated
+    before their parents without recursion
+    """
+    root = node
+    translated = {}
+    stack = [(node, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if id(node) in translated:
+            continue
+        children = node.children()
+        if not expanded and children:
+            stack.append((node, True))
+            stack.extend([(child, False) for child in children])
+            continue
+        children = [translated[id(child)] for child in children]
+
+        if isinstance(node, absy.Variable):
+            translated[id(node)] = variable_name(node.name)
+        elif isinstance(node, absy.Value):
+            translated[id(node)] = repr(node.value)
+        elif isinstance(node, absy.Apply):
+            f = gctx[node.func_name]
+            if isinstance(f, absy.DefinitionBuiltin):
+                translated[id(node)] = "(%s %s %s)" % (children[0], OPERATORS[f.__class__], children[1])
+            else:
+                translated[id(node)] = "%s(%s)" % (function_name(node.func_name), ", ".join(children))
+        elif isinstance(node, absy.Conditional):
+            if len(children) < 3:
+                raise Exception("Conditional without ELSE can not be compiled")
+            translated[id(node)] = "(%s if %s else %s)" % (children[1], children[0], children[2])
+        else:
+            raise Exception("Don't know how to compile: %s of class %s" % (node, node.__class__.__name__))
+    return translated[id(root)]
+
+def is_self_tail_call(d, node):
+    return isinstance(node, absy.Apply) and node.func_name == d.name
+
+def has_self_tail_calls(d):
+    stack = [d.body]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, absy.Conditional):
+            stack.extend(node.children()[1:])
+        elif is_self_tail_call(d, node):
+            return True
+    return False
+
+def definition(d, gctx):
+    """
+    Yield lines of Python function for definition
+    """
+    arg_names = [variable_name(arg_name) for arg_name, arg_type in d.args]
+    yield "def %s(%s):" % (function_name(d.name), ", ".join(arg_names))
+    if not has_self_tail_calls(d):
+        yield "    return " + expression(d.body, gctx)
+        return
+
+    # Body in tail position is turned into statements, self calls assign
+    # the arguments and continue the loop
+    yield "    while True:"
+    stack = [(d.body, 2)]
+    while stack:
+        item, depth = stack.pop()
+        indent = "    " * depth
+        if isinstance(item, str):
+            yield indent + item
+        elif isinstance(item, absy.Conditional) and item.expr_else is not None:
+            yield indent + "if %s:" % expression(item.expr_if, gctx)
+            stack.append((item.expr_else, depth + 1))
+            stack.append(("else:", depth))
+            stack.append((item.expr_then, depth + 1))
+        elif is_self_tail_call(d, item):
+            if arg_names:
+                yield indent + "%s = %s" % (", ".join(arg_names), ", ".join([expression(p, gctx) for p in item.parameters]))
+            yield indent + "continue"
+        else:
+            yield indent + "return " + expression(item, gctx)
+
+def translate(gctx):
+    """
+    Return Python source of definitions reachable from MAIN
+    """
+    graph = callgraph.CallGraph(gctx)
+    lines = []
+    for component in graph.components:
+        for name in component:
+            if name in graph.reachable:
+                lines.extend(definition(gctx[name], gctx))
+                lines.append("")
+    return "\n".join(lines)
+
+def load(source, filename="<µ-Opal>"):
+    """
+    Execute Python source, return dictionary of µ-Opal function name to
+    Python function
+    """
+    namespace = {}
+    exec compile(source, filename, "exec") in namespace
+    prefix = function_name("")
+    functions = {}
+    for python_name, function in namespace.iteritems():
+        if python_name.startswith(prefix):
+            functions[re.sub("_([0-9a-f]{2})", lambda m: chr(int(m.group(1), 16)), python_name[len(prefix):])] = function
+    return functions
+
+def cache_filename(filename):
+    return filename + ".py"
+
+def header(digest):
+    return "# Generated by pycoder %s from source %s\n" % (VERSION, digest)
+
+def compile_file(filename):
+    """
+    Return Python functions for the source file, or None if it has errors.
+    The generated source is reused if it is up to date and rewritten otherwise
+    """
+    digest = astcache.source_digest(filename)
+    if os.path.exists(cache_filename(filename)):
+        with open(cache_filename(filename)) as fh:
+            source = fh.read()
+        if source.startswith(header(digest)):
+            return load(source, cache_filename(filename))
+
+    gctx, errors = astcache.front_end(filename)
+    if errors:
+        for node, msg in errors:
+            print msg, "on line", node.line, "column", node.column
+        return None
+    source = header(digest) + translate(gctx)
+    with open(cache_filename(filename), "w") as fh:
+        fh.write(source)
+    return load(source, cache_filename(filename))
+
+def interpret(filename):
+    functions = compile_file(filename)
+    if functions is not None:
+        return functions["MAIN"]()
+
+if __name__ == "__main__":
+    filename, = sys.argv[1:]
+    print "The MAIN function returned:", interpret(filename)
@@ -1,30 +1,87 @@
 
 import lexer
 import os
+import sys
+import tempfile
+import cPickle as pickle
 import interpreter
-from parser import Parser
+import closures
+import lazy
+import memo
+import batch
+import pycoder
+from parser import Parser, StreamParser, CursorParser, TokenStreamParser
 from ctxcheck import context_check
 import uebb
+import ir
 import coder
+import parparse
+import pareval
+import profiler
+import incremental
+import astcache
+import absy
+import partial
+import inliner
 
 EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(__file__)), "examples")
 
 def test(filename, expected_output):
+    path = os.path.join(EXAMPLES, filename)
+    outputs = {} # Description of the way the program was run to its output
 
     print "### Interpreting", filename
-    interpreted_ast_output = interpreter.interpret(os.path.join(EXAMPLES, filename))
+    outputs["Interpreted output"] = interpreter.interpret(path)
+    outputs["Output of compiled closures"] = closures.interpret(path)
+    outputs["Output of generated Python"] = pycoder.interpret(path)
+    outputs["Lazily evaluated output"] = lazy.interpret(path)
+    # Threshold of zero sends every argument it can to the workers
+    outputs["Parallel output"] = pareval.interpret(path, 2, 0)
+    outputs["Memoized output"] = interpreter.interpret(path, memoize=True)
+    outputs["Partially evaluated output"] = interpreter.interpret(path, fuel=partial.DEFAULT_FUEL)
+    outputs["Output with functions inlined"] = interpreter.interpret(path, inline=True)
+    profile = profiler.Profiler()
+    outputs["Profiled output"] = interpreter.interpret(path, profile=profile)
+    if profile.stats["MAIN"].calls != 1 or profile.frames:
+        raise RuntimeError("Profiler recorded %d calls of MAIN" % profile.stats["MAIN"].calls)
     
-    tokens = tuple(lexer.tokenize(os.path.join(EXAMPLES, filename)))
-    defs, state = Parser(*tokens).parse()
+    defs, state = StreamParser(lexer.tokenize(path)).parse()
     gctx, errors = context_check(defs)
+    outputs["Batched output"] = batch.evaluate(gctx, "MAIN")[0]
+
+    parallel_defs = parparse.parse(path, 2)
+    if [(d.name, d.token.line, d.token.column) for d in parallel_defs] != [(d.name, d.token.line, d.token.column) for d in defs]:
+        raise RuntimeError("Parallel parser returned different definitions")
+
+    frontend = incremental.Frontend()
+    frontend.check(open(path).read())
+    incremental_gctx, errors = frontend.check(open(path).read())
+    if frontend.parsed or frontend.checked:
+        raise RuntimeError("Incremental front end parsed %d and checked %d unchanged definitions" % (frontend.parsed, frontend.checked))
+    outputs["Incrementally checked output"] = incremental_gctx["MAIN"].evaluate({}, incremental_gctx)
+
+    # Interpreting the file has written the cache, this loads it
+    cached_gctx, errors = astcache.front_end(path)
+    outputs["Output from cached syntax tree"] = cached_gctx["MAIN"].evaluate({}, cached_gctx)
+    for name, d in gctx.items():
+        if isinstance(d, absy.DefinitionBuiltin):
+            continue
+        if not d.body.type == cached_gctx[name].body.type == d.return_type:
+            raise RuntimeError("Function %s body was typed %s, cached %s" % (name, d.body.type, cached_gctx[name].body.type))
     
     print "### Testing compiled instructions:"
-    interpreted_instructions_output = uebb.interpret(coder.compile_program(gctx))
+    outputs["Compiled output"] = uebb.interpret(coder.compile_program(gctx))
+    outputs["Output compiled without optimizations"], executed = uebb.execute(coder.compile_program(gctx, optimize=False, eliminate=False))
+    # Little fuel leaves calls to be evaluated and specialized at run time
+    outputs["Compiled output of partially evaluated program"], executed = uebb.execute(coder.compile_program(partial.reduce(gctx, 3)))
+    inlined_gctx = inliner.inline(gctx)
+    outputs["Compiled output with functions inlined"], executed = uebb.execute(coder.compile_program(inlined_gctx))
+    if executed > uebb.execute(coder.compile_program(inlined_gctx, eliminate=False))[1]:
+        raise RuntimeError("Common subexpression elimination made compiled code execute more instructions")
     
-    if interpreted_ast_output != expected_output:
-        raise RuntimeError("Interpreted output %d was incorrect, was expecting %d" % (interpreted_ast_output, expected_output))
-    if interpreted_instructions_output != expected_output:
-        raise RuntimeError("Compiled output %d was incorrect, was expecting %d" % (interpreted_instructions_output, expected_output))
+    for description, output in sorted(outputs.iteritems()):
+        if output != expected_output:
+            raise RuntimeError("%s %d was incorrect, was expecting %d" % (description, output, expected_output))
     print
     print
     
@@ -36,3 +93,199 @@ test("div2.mo", 9)
 test("sqrt.mo", 42)
 
 
+
+def test_batch_overflow():
+    print "### Batched evaluation beyond 64 bits"
+    gctx, errors = astcache.front_end(os.path.join(EXAMPLES, "fac.mo"))
+    results = list(batch.evaluate(gctx, "fac", [3, 30]))
+    if results != [6, 265252859812191058636308480000000]:
+        raise RuntimeError("Batched fac returned %s" % results)
+
+test_batch_overflow()
+
+def check_source(source, expected_output):
+    """
+    Compile source to UEBB instructions with and without common
+    subexpression elimination and check the output of both the
+    instructions and the interpreter
+    """
+    defs, state = CursorParser(tuple(lexer.tokenize_source(source))).parse()
+    gctx, errors = context_check(defs)
+    if errors:
+        raise RuntimeError("Errors in %s: %s" % (source, errors))
+    interpreted_output = gctx["MAIN"].evaluate({}, gctx)
+    for eliminate in True, False:
+        compiled_output, executed = uebb.execute(coder.compile_program(gctx, eliminate=eliminate))
+        if interpreted_output != expected_output or compiled_output != expected_output:
+            raise RuntimeError("Source %s returned %d interpreted and %d compiled, was expecting %d" % (
+                source, interpreted_output, compiled_output, expected_output))
+
+def test_labels():
+    print "### Functions named like labels of conditionals"
+    check_source("DEF MAIN:nat == IF eq(1, 2) THEN 7 ELSE add(else1(5), 1) FI\nDEF else1(x:nat):nat == mul(x, 10)\n", 51)
+    check_source("DEF MAIN:nat == IF eq(1, 2) THEN 7 ELSE add(fi1(5), 1) FI\nDEF fi1(x:nat):nat == mul(x, 10)\n", 51)
+    check_source("DEF MAIN:nat == IF lt(1, 2) THEN add(then1(5), 1) ELSE 7 FI\nDEF then1(x:nat):nat == mul(x, 10)\n", 51)
+
+test_labels()
+
+class UnbalancedEnvironment(coder.Environment):
+    """
+    Environment which pushes 7 twice, so the branch evaluating it leaves
+    one item too many in the stack
+    """
+    def push_constant(env, constant):
+        coder.Environment.push_constant(env, constant)
+        if constant == 7:
+            coder.Environment.push_constant(env, constant)
+
+def test_unbalanced_branches():
+    print "### Branches of conditional leaving stacks of different height"
+    defs, state = CursorParser(tuple(lexer.tokenize_source("DEF MAIN:nat == IF eq(1, 2) THEN 7 ELSE 8 FI\n"))).parse()
+    gctx, errors = context_check(defs)
+    try:
+        UnbalancedEnvironment(gctx).compile(gctx["MAIN"].body)
+    except AssertionError:
+        pass
+    else:
+        raise RuntimeError("Coder did not notice unbalanced branches")
+
+test_unbalanced_branches()
+
+def test_comparisons():
+    print "### Comparisons as values and conditions"
+    # Lt as a value is not compiled to jump
+    check_source("DEF MAIN:nat == add(pick(lt(3, 5)), add(mul(pick(lt(5, 3)), 2), mul(pick(lt(4, 4)), 4)))\n"
+        "DEF pick(b:bool):nat == IF b THEN 10 ELSE 20 FI\n", 130)
+    # Jlt pops the operands in the order they were pushed
+    check_source("DEF MAIN:nat == add(mul(f(3, 5), 100), add(mul(f(5, 3), 10), f(4, 4)))\n"
+        "DEF f(x:nat, y:nat):nat == IF lt(x, y) THEN 1 ELSE 2 FI\n", 122)
+    # Comparison with zero on either side compiles to Jz
+    check_source("DEF MAIN:nat == add(mul(g(0), 100), add(mul(g(7), 10), IF eq(0, 0) THEN 3 ELSE 4 FI))\n"
+        "DEF g(x:nat):nat == IF eq(0, x) THEN 1 ELSE 2 FI\n", 123)
+    check_source("DEF MAIN:nat == add(mul(g(0), 10), g(7))\n"
+        "DEF g(x:nat):nat == IF eq(x, 0) THEN 1 ELSE 2 FI\n", 12)
+
+test_comparisons()
+
+def test_let_tail_call():
+    print "### Self tail call in body of let"
+    # Common subexpression is bound around the tail call which passes on its argument as it is
+    check_source("DEF MAIN:nat == add(f(5), f(20))\n"
+        "DEF f(x:nat):nat == IF lt(mul(add(x, 1), add(x, 1)), 100) THEN mul(add(x, 1), add(x, 1)) ELSE IF lt(x, 10) THEN f(x) ELSE x FI FI\n", 56)
+
+test_let_tail_call()
+
+def test_self_tail_loop():
+    print "### Self tail call deeper than the interpreter can recurse"
+    defs, state = CursorParser(tuple(lexer.tokenize_source("DEF MAIN:nat == sum(5000, 0)\n"
+        "DEF sum(x:nat, y:nat):nat == IF eq(x, 0) THEN y ELSE sum(sub(x, 1), add(y, x)) FI\n"))).parse()
+    gctx, errors = context_check(defs)
+    instructions = coder.compile_program(gctx)
+    # MAIN calls sum, sum jumps back to its beginning instead of calling itself
+    calls = len([i for i in instructions if isinstance(i, ir.Call)])
+    if calls != 1:
+        raise RuntimeError("Compiled code makes %d calls instead of 1" % calls)
+    output, executed = uebb.execute(instructions)
+    if output != 12502500:
+        raise RuntimeError("sum(5000, 0) returned %d, was expecting 12502500" % output)
+
+test_self_tail_loop()
+
+def test_trampoline():
+    print "### Closures with tail calls deeper than Python can recurse"
+    depth = 2 * sys.getrecursionlimit()
+    defs, state = CursorParser(tuple(lexer.tokenize_source("DEF MAIN:nat == sum(%d, 0)\n"
+        "DEF sum(x:nat, y:nat):nat == IF eq(x, 0) THEN y ELSE sum(sub(x, 1), add(y, x)) FI\n" % depth))).parse()
+    gctx, errors = context_check(defs)
+    output = closures.compile_program(gctx)["MAIN"](())
+    if output != depth * (depth + 1) / 2:
+        raise RuntimeError("sum(%d, 0) returned %d, was expecting %d" % (depth, output, depth * (depth + 1) / 2))
+
+test_trampoline()
+
+def test_memo_statistics():
+    print "### Statistics of caches passed to the interpreters"
+    path = os.path.join(EXAMPLES, "fac.mo")
+    gctx, errors = astcache.front_end(path)
+    for interpret in interpreter.interpret, closures.interpret:
+        caches = memo.caches(gctx, ["fac"])
+        interpret(path, memoize=caches)
+        interpret(path, memoize=caches)
+        # fac(10) down to fac(0) miss the first time, the second run hits fac(10)
+        if (caches["fac"].hits, caches["fac"].misses) != (1, 11):
+            raise RuntimeError("Memoized fac made %d hits and %d misses, was expecting 1 and 11" % (
+                caches["fac"].hits, caches["fac"].misses))
+
+test_memo_statistics()
+
+def test_incremental_cache():
+    print "### Cache file of incremental front end"
+    source = open(os.path.join(EXAMPLES, "sqrt.mo")).read()
+    fd, filename = tempfile.mkstemp(suffix=".inc")
+    os.close(fd)
+    try:
+        frontend = incremental.Frontend(filename)
+        frontend.check(source)
+        frontend.save()
+        cached = incremental.Frontend(filename)
+        cached.check(source)
+        if cached.parsed:
+            raise RuntimeError("Incremental front end parsed %d definitions cached in file" % cached.parsed)
+        # Entries written by another toolchain are not loaded, neither is a file which is not a cache
+        for data in pickle.dumps("stale", pickle.HIGHEST_PROTOCOL) + pickle.dumps((frontend.entries, frontend.digests), pickle.HIGHEST_PROTOCOL), "garbage":
+            with open(filename, "wb") as fh:
+                fh.write(data)
+            stale = incremental.Frontend(filename)
+            stale.check(source)
+            if stale.parsed != frontend.parsed:
+                raise RuntimeError("Incremental front end parsed %d definitions instead of %d with stale cache" % (stale.parsed, frontend.parsed))
+    finally:
+        os.unlink(filename)
+
+test_incremental_cache()
+
+def test_token_stream():
+    print "### Parsing examples from token stream"
+    for filename in sorted(os.listdir(EXAMPLES)):
+        if not filename.endswith(".mo"):
+            continue
+        source = open(os.path.join(EXAMPLES, filename)).read()
+        tokens = tuple(lexer.tokenize_source(source))
+        stream = lexer.TokenStream(source)
+        if [(t.__class__, t.lexeme, t.line, t.column) for t in tokens] != \
+                [(stream.kind(i), stream[i].lexeme, stream[i].line, stream[i].column) for i in range(len(stream))]:
+            raise RuntimeError("Token stream of %s differs from tokens" % filename)
+        defs, state = Parser(*tokens).parse()
+        stream_defs, state = TokenStreamParser(stream).parse()
+        if [(str(d), d.token.line, d.token.column) for d in stream_defs] != [(str(d), d.token.line, d.token.column) for d in defs]:
+            raise RuntimeError("Parsing %s from token stream returned different definitions" % filename)
+
+test_token_stream()
+
+def test_nested_conditionals():
+    print "### Partial evaluation of deeply nested conditionals"
+    body = "x"
+    for i in range(3000):
+        body = "IF eq(x, %d) THEN add(x, %d) ELSE %s FI" % (i, i, body)
+    source = "DEF MAIN:nat == f(7)\nDEF f(x:nat):nat == %s\n" % body
+    defs, state = CursorParser(tuple(lexer.tokenize_source(source))).parse()
+    gctx, errors = context_check(defs)
+    for fuel in 0, 1:
+        output, executed = uebb.execute(coder.compile_program(partial.reduce(gctx, fuel)))
+        if output != 14:
+            raise RuntimeError("Nested conditionals returned %d with fuel %d, was expecting 14" % (output, fuel))
+
+test_nested_conditionals()
+
+def test_rebuilt_parameters():
+    print "### Parameters of rebuilt applications"
+    gctx, errors = astcache.front_end(os.path.join(EXAMPLES, "sqrt.mo"))
+    for rebuilt_gctx in inliner.inline(gctx), partial.reduce(gctx, 3):
+        for d in rebuilt_gctx.itervalues():
+            if isinstance(d, absy.DefinitionBuiltin):
+                continue
+            for node in absy.walk(d.body):
+                if isinstance(node, absy.Apply) and not isinstance(node.parameters, tuple):
+                    raise RuntimeError("Application %s in %s has parameters of class %s" % (node, d.name, node.parameters.__class__.__name__))
+
+test_rebuilt_parameters()
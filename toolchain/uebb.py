@@ -1,14 +1,26 @@
 import ir
 
-def interpret(instructions):
+LIMIT = 100000
+
+def interpret(instructions, limit=LIMIT, trace=True):
+    value, executed = execute(instructions, limit, trace)
+    return value
+
+def execute(instructions, limit=LIMIT, trace=False):
+    """
+    Run instructions, return value left on the stack and the number of
+    instructions executed. RuntimeError is raised if the program does
+    not stop within limit instructions, trace prints every instruction
+    """
     pc = 0
     stack = []
     total = 0
-    while total < 250:
+    while total < limit:
         total += 1
         i = instructions[pc]
         pc += 1
-        print ("Issuing %02d. %s" % (pc, i)).ljust(30),
+        if trace:
+            print ("Issuing %02d. %s" % (pc, i)).ljust(30),
         if isinstance(i, ir.PushInt):
             stack.append(i.value)
         elif isinstance(i, ir.PushAddr):
@@ -17,6 +29,14 @@ def interpret(instructions):
             stack, pc = stack[:-1] + [pc], stack[-1]
         elif isinstance(i, ir.Return):
             stack, pc = stack[:-2] + stack[-1:], stack[-2]
+        elif isinstance(i, ir.JumpEqual):
+            stack, a, b = stack[:-2], stack[-2], stack[-1]
+            if a == b:
+                pc = i.target
+        elif isinstance(i, ir.JumpLessThan):
+            stack, a, b = stack[:-2], stack[-2], stack[-1]
+            if a < b:
+                pc = i.target
         elif isinstance(i, ir.ConditionalJump):
             stack, cond = stack[:-1], stack[-1]
             if cond == 0:
@@ -27,6 +47,9 @@ def interpret(instructions):
             stack = stack[:-2] + [stack[-1], stack[-2]]
         elif isinstance(i, ir.Push):
             stack.append(stack[-i.name-1])
+        elif isinstance(i, ir.Store):
+            stack, value = stack[:-1], stack[-1]
+            stack[-i.offset-1] = value
         elif isinstance(i, ir.Mul):
             stack = stack[:-2] + [stack[-2] * stack[-1]]
         elif isinstance(i, ir.Add):
@@ -38,17 +61,20 @@ def interpret(instructions):
 
         elif isinstance(i, ir.Eq):
             stack = stack[:-2] + [int(stack[-1] == stack[-2])]
+        elif isinstance(i, ir.Lt):
+            stack = stack[:-2] + [int(stack[-2] < stack[-1])]
 
         elif isinstance(i, ir.Slide):
             stack = stack[:-i.offset-1] + stack[-1:]
         elif isinstance(i, ir.Stop):
             try:
                 value, = stack
-                return value
+                return value, total
             except ValueError:
                 raise RuntimeError("Expected stack to contain 1 element, got %d" % len(stack))
         else:
             raise RuntimeError("Unknown instruction: %s" % i)
-        print "  stack:", ", ".join([str(i) for i in stack])
+        if trace:
+            print "  stack:", ", ".join([str(i) for i in stack])
     raise RuntimeError("VM timed out")
 